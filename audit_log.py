@@ -0,0 +1,311 @@
+"""
+Журнал обращений: входные данные, результат и версия базы знаний в SQLite
+
+Запись не блокирует интерфейс: record() только кладет обращение в очередь, а
+фоновый поток сбрасывает очередь пакетами в одну транзакцию (WAL). В той же
+транзакции обновляются сводки - число обращений по состояниям за день и
+распределение баллов по состояниям, - поэтому панель аналитики читает только
+их и не просматривает журнал целиком.
+
+    python audit_log.py benchmark --records 1000000     # запись и чтение сводок на синтетических данных
+    python audit_log.py rebuild-rollups                  # пересчет сводок по журналу
+
+Файл журнала - AUDIT_LOG_PATH (по умолчанию audit_log.sqlite); AUDIT_LOG=0 отключает запись.
+"""
+import argparse
+import atexit
+import collections
+import datetime
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.environ.get("AUDIT_LOG_PATH", os.path.join(ROOT, "audit_log.sqlite"))
+ENABLED = os.environ.get("AUDIT_LOG", "1") != "0"
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_QUEUE_SIZE = 10_000
+PROBABILITY_BUCKETS = 10
+# Обращения с приоритетным правилом: баллы правила, а не вероятность, при любом методе оценки
+OVERRIDE_ENGINE = "override"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS encounters (
+    id INTEGER PRIMARY KEY,
+    recorded_at REAL NOT NULL,
+    day TEXT NOT NULL,
+    symptoms TEXT NOT NULL,
+    lab_data TEXT NOT NULL,
+    temperature REAL,
+    bp_systolic REAL,
+    bp_diastolic REAL,
+    wbc REAL,
+    crp REAL,
+    engine TEXT NOT NULL,
+    main_diagnosis TEXT NOT NULL,
+    score REAL NOT NULL,
+    override INTEGER NOT NULL,
+    differential TEXT NOT NULL,
+    knowledge_base_version TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS daily_counts (
+    day TEXT NOT NULL,
+    condition TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (day, condition)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS score_distribution (
+    condition TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (condition, engine, bucket)
+) WITHOUT ROWID;
+"""
+
+_INSERT = """
+INSERT INTO encounters (recorded_at, day, symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp,
+                        engine, main_diagnosis, score, override, differential, knowledge_base_version)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_UPSERT_DAILY = """
+INSERT INTO daily_counts (day, condition, count) VALUES (?, ?, ?)
+ON CONFLICT (day, condition) DO UPDATE SET count = count + excluded.count
+"""
+_UPSERT_SCORES = """
+INSERT INTO score_distribution (condition, engine, bucket, count) VALUES (?, ?, ?, ?)
+ON CONFLICT (condition, engine, bucket) DO UPDATE SET count = count + excluded.count
+"""
+
+
+def connect(path=DEFAULT_PATH):
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+    except sqlite3.Error:
+        connection.close()
+        raise
+    return connection
+
+
+def score_bucket(engine, score):
+    """
+    Корзина распределения: целые баллы правил или десятые доли вероятности модели
+    """
+    if engine in ("rules", OVERRIDE_ENGINE):
+        return int(score)
+    return min(int(score * PROBABILITY_BUCKETS), PROBABILITY_BUCKETS - 1)
+
+
+def distribution_key(condition, engine, score, override):
+    """
+    Ключ сводки распределения (состояние, метод, корзина); приоритетное правило учитывается отдельно
+    """
+    engine = OVERRIDE_ENGINE if override else engine
+    return condition, engine, score_bucket(engine, score)
+
+
+def encounter_row(symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, result, recorded_at=None):
+    """
+    Строка журнала по входным данным и результату (CachedDiagnosis из result_cache)
+    """
+    recorded_at = time.time() if recorded_at is None else recorded_at
+    return (
+        recorded_at,
+        datetime.date.fromtimestamp(recorded_at).isoformat(),
+        json.dumps(list(symptoms), ensure_ascii=False),
+        json.dumps(list(lab_data), ensure_ascii=False),
+        float(temperature), float(bp_systolic), float(bp_diastolic), float(wbc), float(crp),
+        result.engine,
+        result.main_diagnosis,
+        float(result.score),
+        int(result.override),
+        json.dumps([list(item) for item in result.differential], ensure_ascii=False),
+        result.knowledge_base_version,
+    )
+
+
+def write_batch(connection, rows):
+    """
+    Записывает строки журнала и обновляет сводки в одной транзакции
+    """
+    # Поля строки: 1 - день, 9 - метод оценки, 10 - основной диагноз, 11 - баллы, 12 - приоритетное правило
+    daily = collections.Counter((row[1], row[10]) for row in rows)
+    scores = collections.Counter(distribution_key(row[10], row[9], row[11], row[12]) for row in rows)
+    with connection:
+        connection.executemany(_INSERT, rows)
+        connection.executemany(_UPSERT_DAILY, [(*key, count) for key, count in daily.items()])
+        connection.executemany(_UPSERT_SCORES, [(*key, count) for key, count in scores.items()])
+
+
+class AuditLog:
+    """
+    Неблокирующий журнал: очередь в памяти и фоновый поток, сбрасывающий ее пакетами
+    """
+
+    def __init__(self, path=DEFAULT_PATH, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._connection = connect(path)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, result, block=False):
+        """
+        Ставит обращение в очередь на запись; при переполненной очереди (и block=False) обращение не записывается
+        """
+        try:
+            self._queue.put(
+                encounter_row(symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, result), block
+            )
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, first):
+        rows = [first]
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        while not (self._stopped.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            rows = self._drain(first)
+            try:
+                write_batch(self._connection, rows)
+                self.written += len(rows)
+            except sqlite3.Error as e:
+                self.failed += len(rows)
+                warnings.warn(f"Журнал обращений: не записано {len(rows)} строк: {e}")
+
+    def flush(self, timeout=10.0):
+        """
+        Ждет, пока очередь будет записана (для тестов и завершения работы)
+        """
+        deadline = time.monotonic() + timeout
+        while not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        if not self._stopped.is_set():
+            self._stopped.set()
+            self._thread.join(timeout=10)
+            self._connection.close()
+
+    def stats(self):
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "queue_depth": self._queue.qsize(),
+        }
+
+
+# СВОДКИ ДЛЯ ПАНЕЛИ АНАЛИТИКИ
+def read_rollups(path=DEFAULT_PATH):
+    """
+    Сводки без обращения к журналу: (число обращений по дням и состояниям, распределение баллов)
+    """
+    import pandas as pd
+
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        daily = pd.read_sql_query("SELECT day, condition, count FROM daily_counts ORDER BY day", connection)
+        scores = pd.read_sql_query(
+            "SELECT condition, engine, bucket, count FROM score_distribution ORDER BY condition, engine, bucket",
+            connection,
+        )
+    finally:
+        connection.close()
+    return daily, scores
+
+
+def rebuild_rollups(path=DEFAULT_PATH, chunk=100_000):
+    """
+    Пересчитывает сводки по всему журналу (обслуживание, например после ручной правки данных)
+    """
+    connection = connect(path)
+    try:
+        daily, scores = collections.Counter(), collections.Counter()
+        cursor = connection.execute("SELECT day, engine, main_diagnosis, score, override FROM encounters")
+        while rows := cursor.fetchmany(chunk):
+            for day, engine, condition, score, override in rows:
+                daily[day, condition] += 1
+                scores[distribution_key(condition, engine, score, override)] += 1
+        with connection:
+            connection.execute("DELETE FROM daily_counts")
+            connection.execute("DELETE FROM score_distribution")
+            connection.executemany(_UPSERT_DAILY, [(*key, count) for key, count in daily.items()])
+            connection.executemany(_UPSERT_SCORES, [(*key, count) for key, count in scores.items()])
+    finally:
+        connection.close()
+
+
+def benchmark(path, records=1_000_000, seed=0):
+    """
+    Скорость фоновой записи и время чтения сводок на синтетических обращениях
+    """
+    from benchmarks import synthetic_cohort
+    from knowledge_base import get_knowledge_base
+    from result_cache import ResultCache
+
+    kb = get_knowledge_base()
+    cache = ResultCache()
+    cohort = synthetic_cohort(min(records, 20_000), seed, kb)
+    results = [cache.diagnose(*cohort.patient(i), kb=kb) for i in range(len(cohort))]
+
+    log = AuditLog(path)
+    started = time.perf_counter()
+    for i in range(records):
+        j = i % len(cohort)
+        log.record(*cohort.patient(j), results[j], block=True)
+    enqueued = time.perf_counter() - started
+    log.flush(timeout=3600)
+    log.close()
+    written = time.perf_counter() - started
+    print(f"{records:,} обращений: генерация и постановка в очередь {enqueued:.1f} с, "
+          f"запись {records / written:,.0f} записей/с")
+
+    started = time.perf_counter()
+    daily, scores = read_rollups(path)
+    print(f"Чтение сводок: {(time.perf_counter() - started) * 1000:.1f} мс "
+          f"({len(daily)} строк по дням, {len(scores)} корзин баллов)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Журнал обращений и сводки для панели аналитики")
+    parser.add_argument("command", choices=["benchmark", "rebuild-rollups"])
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--records", type=int, default=1_000_000)
+    args = parser.parse_args(argv)
+
+    if args.command == "benchmark":
+        benchmark(args.path, args.records)
+    else:
+        rebuild_rollups(args.path)
+        print(f"Сводки пересчитаны: {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+"""
+Замеры производительности диагностики и проверка новых реализаций по эталону
+
+Генератор synthetic_cohort создает воспроизводимых (по seed) пациентов:
+для каждого заболевания из базы знаний берутся его признаки с положительным
+весом, показатели (температура, лейкоциты, СРБ, АД) подбираются под признаки,
+добавляются случайные посторонние симптомы и значения ровно на порогах.
+
+Тот же генератор служит эталонной проверкой: результаты любой реализации
+сравниваются с medical_diagnosis_system.
+
+    python benchmarks.py run                          # замеры, запись в историю, сравнение с прошлым коммитом
+    python benchmarks.py run --max-slowdown 0.2       # код выхода 1, если метрика ухудшилась больше чем на 20%
+                                                      # (p95 задержек - больше чем на --max-tail-slowdown)
+    python benchmarks.py run --render                 # плюс время перерисовки app.py после нажатия кнопки
+    python benchmarks.py oracle --engine batch        # batch, diagnose, cache, parallel или модуль:функция
+    python benchmarks.py history
+
+История хранится в BENCHMARK_HISTORY (по умолчанию benchmark_history.jsonl),
+по одной записи на запуск с хэшем коммита.
+"""
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+import numpy as np
+
+from diagnosis import diagnose, medical_diagnosis_batch, medical_diagnosis_system
+from knowledge_base import get_knowledge_base
+from vocabulary import LAB_FINDINGS, SYMPTOMS, decode
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(ROOT, "app.py")
+HISTORY_PATH = os.environ.get("BENCHMARK_HISTORY", os.path.join(ROOT, "benchmark_history.jsonl"))
+DEFAULT_MAX_SLOWDOWN = float(os.environ.get("BENCHMARK_MAX_SLOWDOWN", 0.25))
+# p95 вызовов длиной в микросекунды зависит от планировщика и прерываний: допуск для хвоста шире
+DEFAULT_MAX_TAIL_SLOWDOWN = float(os.environ.get("BENCHMARK_MAX_TAIL_SLOWDOWN", 1.0))
+TAIL_METRIC_SUFFIX = "_p95"
+# Задержка вызова - медиана по стольким проходам по пациентам
+DEFAULT_LATENCY_REPEATS = 5
+
+DEFAULT_SEED = 0
+NOISE_PROBABILITY = 0.05
+FEATURE_PROBABILITY = 0.75
+BOUNDARY_PROBABILITY = 0.1
+# Названия не из своего списка (анализ среди симптомов и наоборот): эталон их не учитывает
+MISPLACED_PROBABILITY = 0.01
+
+
+# ГЕНЕРАТОР ПАЦИЕНТОВ
+@dataclass
+class Cohort:
+    """
+    Синтетические пациенты в формате аргументов medical_diagnosis_system
+    """
+    symptoms: list
+    lab_data: list
+    temperature: list
+    bp_systolic: list
+    bp_diastolic: list
+    wbc: list
+    crp: list
+    source: list
+
+    def __len__(self):
+        return len(self.symptoms)
+
+    def patient(self, i):
+        return (
+            self.symptoms[i], self.lab_data[i], self.temperature[i],
+            self.bp_systolic[i], self.bp_diastolic[i], self.wbc[i], self.crp[i],
+        )
+
+    def columns(self):
+        return self.symptoms, self.lab_data, self.temperature, self.bp_systolic, self.bp_diastolic, self.wbc, self.crp
+
+
+def _positive_features(info):
+    return [feature for feature, present, absent in info.get("scoring", ()) if present > absent]
+
+
+def synthetic_cohort(n, seed=DEFAULT_SEED, kb=None, noise=NOISE_PROBABILITY, boundary=BOUNDARY_PROBABILITY,
+                     misplaced=MISPLACED_PROBABILITY):
+    """
+    n пациентов, равномерно распределенных по заболеваниям базы знаний
+    """
+    kb = kb if kb is not None else get_knowledge_base()
+    rng = np.random.default_rng(seed)
+    # Отдельный генератор: перепутанные списки не меняют остальных пациентов когорты
+    misplaced_rng = np.random.default_rng([seed, 1])
+    thresholds = kb.thresholds
+    fever = thresholds["fever_temperature"]
+    subfebrile = thresholds["subfebrile_temperature"]
+    override_symptoms = decode(kb.override_mask)
+    cohort = Cohort([], [], [], [], [], [], [], [])
+
+    for condition in rng.choice(kb.condition_names, size=n):
+        condition = str(condition)
+        symptoms, lab_data = set(), set()
+        temperature = round(float(rng.uniform(36.3, 36.9)), 1)
+        wbc = round(float(rng.uniform(4.0, 9.5)), 1)
+        crp = round(float(rng.uniform(0.0, 4.5)), 1)
+        bp_systolic, bp_diastolic = int(rng.integers(100, 160)), int(rng.integers(60, 100))
+
+        for feature in _positive_features(kb[condition]):
+            if rng.random() >= FEATURE_PROBABILITY:
+                continue
+            if feature == "fever":
+                symptoms.add("Лихорадка >38°C")
+                temperature = round(float(rng.uniform(fever + 0.1, 40.5)), 1)
+            elif feature == "subfebrile":
+                symptoms.add("Субфебрильная температура")
+                temperature = round(float(rng.uniform(subfebrile + 0.1, fever - 0.1)), 1)
+            elif feature == "leukocytosis":
+                if rng.random() < 0.5:
+                    lab_data.add("Лейкоцитоз")
+                wbc = round(float(rng.uniform(thresholds["wbc"] + 0.1, 20.0)), 1)
+            elif feature == "elevated_crp":
+                if rng.random() < 0.5:
+                    lab_data.add("Повышение СРБ")
+                crp = round(float(rng.uniform(thresholds["crp"] + 0.1, 80.0)), 1)
+            elif feature == "urinary_leukocytes":
+                lab_data.add("Лейкоциты в моче")
+            elif feature == "cough_without_sputum":
+                symptoms.add("Кашель")
+            elif feature in LAB_FINDINGS:
+                lab_data.add(feature)
+            else:
+                symptoms.add(feature)
+
+        if condition == kb.override_condition and override_symptoms:
+            symptoms.add(str(rng.choice(override_symptoms)))
+            bp_systolic = int(rng.integers(thresholds["bp_systolic"] + 1, 240))
+            bp_diastolic = int(rng.integers(thresholds["bp_diastolic"] + 1, 150))
+
+        symptoms.update(name for name in SYMPTOMS if rng.random() < noise)
+        lab_data.update(name for name in LAB_FINDINGS if rng.random() < noise / 2)
+
+        # Значения ровно на порогах проверяют строгость сравнений
+        if rng.random() < boundary:
+            temperature = float(rng.choice([fever, subfebrile]))
+        if rng.random() < boundary:
+            wbc = float(thresholds["wbc"])
+        if rng.random() < boundary:
+            crp = float(thresholds["crp"])
+        if rng.random() < boundary:
+            bp_systolic, bp_diastolic = thresholds["bp_systolic"], thresholds["bp_diastolic"]
+
+        symptoms = sorted(symptoms, key=SYMPTOMS.index)
+        lab_data = sorted(lab_data, key=LAB_FINDINGS.index)
+        symptoms += [name for name in LAB_FINDINGS if misplaced_rng.random() < misplaced]
+        lab_data += [name for name in SYMPTOMS if misplaced_rng.random() < misplaced]
+        cohort.symptoms.append(symptoms)
+        cohort.lab_data.append(lab_data)
+        cohort.temperature.append(temperature)
+        cohort.bp_systolic.append(bp_systolic)
+        cohort.bp_diastolic.append(bp_diastolic)
+        cohort.wbc.append(wbc)
+        cohort.crp.append(crp)
+        cohort.source.append(condition)
+    return cohort
+
+
+# РЕАЛИЗАЦИИ ДЛЯ СРАВНЕНИЯ
+# Каждая принимает Cohort и возвращает список результатов в формате medical_diagnosis_system
+def _legacy_engine(cohort):
+    return [medical_diagnosis_system(*_legacy_args(cohort.patient(i))) for i in range(len(cohort))]
+
+
+def _legacy_args(patient):
+    symptoms, lab_data, *vitals = patient
+    return (symptoms, lab_data, "", *vitals)
+
+
+def _diagnose_engine(cohort):
+    return [diagnose(*cohort.patient(i)) for i in range(len(cohort))]
+
+
+def _batch_engine(cohort):
+    result = medical_diagnosis_batch(*cohort.columns())
+    return [result.result(i) for i in range(len(result))]
+
+
+def _cache_engine(cohort):
+    from result_cache import ResultCache
+
+    cache = ResultCache(maxsize=len(cohort) or 1)
+    results = []
+    for i in range(len(cohort)):
+        cached = cache.diagnose(*cohort.patient(i))
+        all_diagnoses = cached.all_diagnoses
+        results.append((cached.main_diagnosis, list(all_diagnoses) if isinstance(all_diagnoses, tuple) else all_diagnoses))
+    return results
+
+
+def _parallel_engine(cohort):
+    from parallel_scoring import medical_diagnosis_parallel
+
+    # Когорта делится на несколько частей и всегда считается в пуле, даже на одном ядре
+    result = medical_diagnosis_parallel(
+        *cohort.columns(), workers=2, shard_size=max(1, len(cohort) // 4), force_pool=True,
+    )
+    return [result.result(i) for i in range(len(result))]
+
+
+ENGINES = {
+    "legacy": _legacy_engine,
+    "diagnose": _diagnose_engine,
+    "batch": _batch_engine,
+    "cache": _cache_engine,
+    "parallel": _parallel_engine,
+}
+
+
+def resolve_engine(spec):
+    """
+    Реализация по имени из ENGINES или "модуль:функция" с сигнатурой diagnose (вызывается на каждого пациента)
+    """
+    if spec in ENGINES:
+        return ENGINES[spec]
+    module_name, _, function_name = spec.partition(":")
+    if not function_name:
+        raise ValueError(f"Неизвестная реализация {spec!r}: {', '.join(ENGINES)} или модуль:функция")
+    function = getattr(importlib.import_module(module_name), function_name)
+    return lambda cohort: [function(*cohort.patient(i)) for i in range(len(cohort))]
+
+
+def check_engine(engine, cohort, limit=10):
+    """
+    Сравнивает реализацию с medical_diagnosis_system; возвращает (число расхождений, первые расхождения)
+    """
+    expected = _legacy_engine(cohort)
+    actual = engine(cohort)
+    mismatches = [
+        (i, cohort.patient(i), want, got)
+        for i, (want, got) in enumerate(zip(expected, actual))
+        if want != got
+    ]
+    if len(actual) != len(expected):
+        raise AssertionError(f"Реализация вернула {len(actual)} результатов вместо {len(expected)}")
+    return len(mismatches), mismatches[:limit]
+
+
+# ЗАМЕРЫ
+# Все метрики - "меньше лучше": задержки в мкс, время пакета в нс на запись, память в байтах на запись
+def _percentiles_us(samples_ns):
+    samples = np.asarray(samples_ns, dtype=np.float64) / 1000
+    return float(np.percentile(samples, 50)), float(np.percentile(samples, 95))
+
+
+def call_latency(function, patients, warmup=200, repeats=DEFAULT_LATENCY_REPEATS):
+    """
+    Задержка одного вызова, мкс: (p50, p95), каждая - медиана по repeats проходам по пациентам
+    """
+    for patient in patients[:warmup]:
+        function(*patient)
+    clock = time.perf_counter_ns
+    passes = []
+    for _ in range(repeats):
+        samples = []
+        for patient in patients:
+            started = clock()
+            function(*patient)
+            samples.append(clock() - started)
+        passes.append(_percentiles_us(samples))
+    p50, p95 = zip(*passes)
+    return statistics.median(p50), statistics.median(p95)
+
+
+def batch_time_per_record(cohort, repeats=3):
+    """
+    Лучшее из repeats время пакетной диагностики, нс на запись
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter_ns()
+        medical_diagnosis_batch(*cohort.columns())
+        best = min(best, time.perf_counter_ns() - started)
+    return best / len(cohort)
+
+
+def batch_memory_per_record(cohort):
+    """
+    Пиковый объем памяти, выделяемой пакетной диагностикой, байт на запись
+    """
+    tracemalloc.start()
+    try:
+        medical_diagnosis_batch(*cohort.columns())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / len(cohort)
+
+
+RENDER_SYMPTOMS = ["Лихорадка >38°C", "Кашель с мокротой", "Одышка", "Боль в груди"]
+
+
+def _count_elements(node):
+    children = getattr(node, "children", None)
+    if not children:
+        return 1
+    return sum(_count_elements(child) for child in children.values())
+
+
+def render_latency(app_path=APP_PATH, runs=5, symptoms=RENDER_SYMPTOMS):
+    """
+    Перерисовка app.py после нажатия кнопки диагностики (Streamlit AppTest):
+    (медиана времени в мс, число элементов основной области страницы)
+    """
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(app_path).run(timeout=60)
+    at.multiselect(key="symptoms").set_value(symptoms)
+    samples = []
+    for _ in range(runs + 1):
+        submit = next(button for button in at.button if button.label == "Провести диагностику")
+        started = time.perf_counter()
+        submit.click().run(timeout=60)
+        samples.append((time.perf_counter() - started) * 1000)
+        if at.exception:
+            raise RuntimeError(at.exception)
+    return statistics.median(samples[1:]), _count_elements(at.main)
+
+
+def run_benchmarks(calls=2000, batch=100_000, seed=DEFAULT_SEED, render=False):
+    """
+    Полный набор замеров: {метрика: значение}
+    """
+    from result_cache import ResultCache
+
+    calls_cohort = synthetic_cohort(calls, seed)
+    patients = [calls_cohort.patient(i) for i in range(calls)]
+    metrics = {}
+
+    metrics["legacy_call_us_p50"], metrics["legacy_call_us_p95"] = call_latency(
+        lambda *patient: medical_diagnosis_system(*_legacy_args(patient)), patients
+    )
+    metrics["diagnose_call_us_p50"], metrics["diagnose_call_us_p95"] = call_latency(diagnose, patients)
+    cache = ResultCache(maxsize=calls)
+    for patient in patients:
+        cache.diagnose(*patient)
+    metrics["cached_call_us_p50"], metrics["cached_call_us_p95"] = call_latency(cache.diagnose, patients, warmup=0)
+
+    batch_cohort = synthetic_cohort(batch, seed + 1)
+    metrics["batch_ns_per_record"] = batch_time_per_record(batch_cohort)
+    metrics["batch_bytes_per_record"] = batch_memory_per_record(batch_cohort)
+    if render:
+        metrics["render_ms"], metrics["render_elements"] = render_latency()
+    return metrics
+
+
+# ИСТОРИЯ ПО КОММИТАМ
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def current_commit():
+    commit = _git("rev-parse", "--short", "HEAD") or "unknown"
+    return commit + ("-dirty" if _git("status", "--porcelain", "--untracked-files=no") else "")
+
+
+def load_history(path=HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(record, path=HISTORY_PATH):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def find_baseline(history, commit, baseline=None):
+    """
+    Запись для сравнения: последняя с указанным коммитом или последняя с другим коммитом
+    """
+    for record in reversed(history):
+        if baseline is not None:
+            if record["commit"].startswith(baseline):
+                return record
+        elif record["commit"] != commit:
+            return record
+    return None
+
+
+def compare(metrics, baseline_metrics, max_slowdown, max_tail_slowdown=DEFAULT_MAX_TAIL_SLOWDOWN):
+    """
+    Строки (метрика, текущее, базовое, изменение) и список метрик, ухудшившихся больше допустимого;
+    для p95 задержек допуск max_tail_slowdown
+    """
+    rows, regressions = [], []
+    for name, value in metrics.items():
+        base = baseline_metrics.get(name)
+        change = value / base - 1 if base else None
+        rows.append((name, value, base, change))
+        limit = max_tail_slowdown if name.endswith(TAIL_METRIC_SUFFIX) else max_slowdown
+        if change is not None and change > limit:
+            regressions.append(name)
+    return rows, regressions
+
+
+def _print_rows(rows):
+    print(f"{'метрика':<26} {'текущее':>12} {'базовое':>12} {'изменение':>10}")
+    for name, value, base, change in rows:
+        base_text = f"{base:>12.2f}" if base is not None else f"{'-':>12}"
+        change_text = f"{change:>+10.1%}" if change is not None else f"{'-':>10}"
+        print(f"{name:<26} {value:>12.2f} {base_text} {change_text}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры производительности и эталонная проверка диагностики")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Замеры с записью в историю и сравнением")
+    run.add_argument("--calls", type=int, default=2000, help="Пациентов в замере задержки одного вызова")
+    run.add_argument("--batch", type=int, default=100_000, help="Пациентов в пакетном замере")
+    run.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    run.add_argument("--render", action="store_true", help="Замерить перерисовку app.py (нужен streamlit)")
+    run.add_argument("--baseline", help="Коммит для сравнения (по умолчанию последний другой коммит в истории)")
+    run.add_argument("--max-slowdown", type=float, default=DEFAULT_MAX_SLOWDOWN,
+                     help="Допустимое ухудшение метрики, доля (0.25 = 25%%)")
+    run.add_argument("--max-tail-slowdown", type=float, default=DEFAULT_MAX_TAIL_SLOWDOWN,
+                     help="Допустимое ухудшение p95 задержек вызова, доля")
+    run.add_argument("--history", default=HISTORY_PATH)
+    run.add_argument("--no-save", action="store_true", help="Не записывать результат в историю")
+
+    oracle = sub.add_parser("oracle", help="Сравнение реализации с medical_diagnosis_system")
+    oracle.add_argument("--engine", default="batch", help=f"{', '.join(ENGINES)} или модуль:функция")
+    oracle.add_argument("--patients", type=int, default=20_000)
+    oracle.add_argument("--seed", type=int, default=DEFAULT_SEED)
+
+    history = sub.add_parser("history", help="Показать историю замеров")
+    history.add_argument("--history", default=HISTORY_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == "oracle":
+        cohort = synthetic_cohort(args.patients, args.seed)
+        count, examples = check_engine(resolve_engine(args.engine), cohort)
+        print(f"{args.engine}: {count} расхождений на {len(cohort):,} пациентах (seed {args.seed})")
+        for i, patient, want, got in examples:
+            print(f"  #{i} {patient}\n    ожидалось {want}\n    получено  {got}")
+        if count:
+            sys.exit(1)
+
+    elif args.command == "history":
+        for record in load_history(args.history):
+            summary = ", ".join(f"{name}={value:.1f}" for name, value in record["metrics"].items())
+            print(f"{record['timestamp']}  {record['commit']:<16} {summary}")
+
+    else:
+        commit = current_commit()
+        metrics = run_benchmarks(args.calls, args.batch, args.seed, args.render)
+        baseline = find_baseline(load_history(args.history), commit, args.baseline)
+        rows, regressions = compare(
+            metrics, baseline["metrics"] if baseline else {}, args.max_slowdown, args.max_tail_slowdown,
+        )
+        print(f"Коммит {commit}, сравнение с {baseline['commit'] if baseline else '(нет записей)'}")
+        _print_rows(rows)
+        if not args.no_save:
+            append_history({
+                "commit": commit,
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "calls": args.calls,
+                "batch": args.batch,
+                "seed": args.seed,
+                "metrics": metrics,
+            }, args.history)
+        if regressions:
+            print(
+                f"Ухудшение больше {args.max_slowdown:.0%} (p95 - больше {args.max_tail_slowdown:.0%}): "
+                f"{', '.join(regressions)}",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
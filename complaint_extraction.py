@@ -0,0 +1,278 @@
+"""
+Извлечение симптомов из жалоб в свободной форме
+
+Текст жалобы делится на фрагменты (по знакам препинания и союзу "и"); фрагменты
+под отрицанием ("отрицает головную боль", "нет тошноты, рвоты", "кашля нет")
+отбрасываются по тем же правилам, что и в symptom_matcher.py, а фрагменты с
+числами ("температура 39") - потому что измерения вводятся отдельными полями.
+Остальные фрагменты кодируются локальной моделью-энкодером и сравниваются с эмбеддингами
+названий симптомов из vocabulary.py; каждому фрагменту сопоставляется самый
+близкий симптом, если косинусная близость не ниже порога.
+
+Модель загружается один раз на процесс (get_extractor); инференс на CPU идет
+пакетами: динамическая int8-квантизация линейных слоев, ограниченное число
+потоков и группировка фрагментов по длине, чтобы дополнение было минимальным.
+Для офлайн-проверок есть детерминированная заглушка StubEncoder (без torch).
+
+    python complaint_extraction.py --benchmark --count 2000            # модель
+    python complaint_extraction.py --benchmark --stub                  # заглушка
+    python complaint_extraction.py "Кашель с мокротой, температура 38.5, одышка"
+"""
+import argparse
+import hashlib
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from instrumentation import timed
+from ml_support import load_ml_stack
+from symptom_matcher import AFFIRMATION_CUES, CLAUSE_BREAKS, NEGATION_CUES, POST_NEGATION_CUES, stem
+from vocabulary import SYMPTOMS
+
+DEFAULT_MODEL = os.environ.get("COMPLAINT_MODEL", "cointegrated/rubert-tiny2")
+STUB_MODEL = "stub"
+DEFAULT_THRESHOLD = 0.6
+STUB_THRESHOLD = 0.5
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_MAX_LENGTH = 64
+DEFAULT_THREADS = min(4, os.cpu_count() or 1)
+
+_CLAUSE_SPLIT = re.compile(r"[.,;:!?\n]+|\s+и\s+", re.IGNORECASE)
+_SEPARATOR = re.compile(r"([.,;:!?\n]+|\s+и\s+)", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"[.;:!?\n]")
+_NEGATION = frozenset(stem(cue) for cue in NEGATION_CUES)
+_POST_NEGATION = frozenset(stem(cue) for cue in POST_NEGATION_CUES)
+_CLAUSE_BREAKS = frozenset(stem(word) for word in (*CLAUSE_BREAKS, *AFFIRMATION_CUES))
+_MEASUREMENT = re.compile(r"\d")
+
+
+def split_clauses(note):
+    return [clause.strip() for clause in _CLAUSE_SPLIT.split(note) if clause.strip()]
+
+
+def affirmed_clauses(note):
+    """
+    Фрагменты жалобы без отрицаемых находок: отрицание действует до конца предложения
+    через перечисление ("нет тошноты, рвоты") и прерывается словами нового фрагмента
+    или утверждением ("но", "беспокоит", "есть"), кроме слова сразу после отрицания
+    ("не беспокоит кашель"); отрицание после находки ("кашля нет") снимает только ее
+    """
+    parts = _SEPARATOR.split(note)
+    clauses = []
+    negated = False
+    for i in range(0, len(parts), 2):
+        kept = []
+        after_cue = False
+        for word in parts[i].split():
+            token = stem(word.strip("\"'()«»-"))
+            if token in _CLAUSE_BREAKS:
+                negated = negated and after_cue
+            elif token in _POST_NEGATION and kept and not negated:
+                kept = []
+                continue
+            elif token in _NEGATION:
+                negated = after_cue = True
+                if kept:
+                    clauses.append(" ".join(kept))
+                    kept = []
+                continue
+            after_cue = False
+            if not negated:
+                kept.append(word)
+        if kept:
+            clauses.append(" ".join(kept))
+        if i + 1 < len(parts) and _SENTENCE_END.search(parts[i + 1]):
+            negated = False
+    return clauses
+
+
+class TransformerEncoder:
+    """
+    Энкодер предложений на основе модели transformers с усреднением по токенам
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL, num_threads=DEFAULT_THREADS, quantize=True,
+                 max_length=DEFAULT_MAX_LENGTH):
+        torch, transformers = load_ml_stack()
+        self._torch = torch
+        torch.set_num_threads(num_threads)
+        self.model_name = model_name
+        self.max_length = max_length
+        self.tokenizer = transformers.AutoTokenizer.from_pretrained(model_name)
+        model = transformers.AutoModel.from_pretrained(model_name).eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+
+    def encode(self, texts, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Нормированные эмбеддинги текстов; тексты группируются по длине, чтобы пакеты дополнялись минимально
+        """
+        torch = self._torch
+        texts = list(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        chunks = []
+        with torch.inference_mode():
+            for start in range(0, len(order), batch_size):
+                batch = [texts[i] for i in order[start:start + batch_size]]
+                tokens = self.tokenizer(
+                    batch, padding="longest", truncation=True, max_length=self.max_length, return_tensors="pt"
+                )
+                hidden = self.model(**tokens).last_hidden_state
+                mask = tokens["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1.0)
+                chunks.append(torch.nn.functional.normalize(pooled, dim=-1).numpy())
+
+        embeddings = np.empty((len(texts), chunks[0].shape[1] if chunks else 0), dtype=np.float32)
+        if chunks:
+            embeddings[order] = np.concatenate(chunks)
+        return embeddings
+
+
+class StubEncoder:
+    """
+    Детерминированная заглушка: хэшированные символьные триграммы, без сети и torch
+    """
+
+    model_name = STUB_MODEL
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                digest = hashlib.blake2b(padded[i:i + 3].encode("utf-8"), digest_size=4).digest()
+                vector[int.from_bytes(digest, "little") % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, texts, batch_size=DEFAULT_BATCH_SIZE):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self._vector(text) for text in texts])
+
+
+class ComplaintExtractor:
+    """
+    Сопоставляет жалобы в свободной форме каноническому списку симптомов
+    """
+
+    def __init__(self, encoder, labels=SYMPTOMS, threshold=DEFAULT_THRESHOLD, batch_size=DEFAULT_BATCH_SIZE):
+        self.encoder = encoder
+        self.labels = tuple(labels)
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.label_embeddings = encoder.encode(self.labels, batch_size)
+
+    @timed("complaint_model")
+    def extract_batch(self, notes):
+        """
+        Симптомы для каждой жалобы; все фрагменты всех жалоб кодируются одним пакетным вызовом
+        """
+        clauses, owners = [], []
+        for i, note in enumerate(notes):
+            for clause in affirmed_clauses(note or ""):
+                if not _MEASUREMENT.search(clause):
+                    clauses.append(clause)
+                    owners.append(i)
+        found = [[] for _ in notes]
+        if not clauses:
+            return found
+
+        similarity = self.encoder.encode(clauses, self.batch_size) @ self.label_embeddings.T
+        best = similarity.argmax(axis=1)
+        matched = np.zeros((len(notes), len(self.labels)), dtype=bool)
+        confident = similarity[np.arange(len(clauses)), best] >= self.threshold
+        matched[np.array(owners)[confident], best[confident]] = True
+        for i, row in enumerate(matched):
+            found[i] = [self.labels[j] for j in np.flatnonzero(row)]
+        return found
+
+    def extract(self, note):
+        return self.extract_batch([note])[0]
+
+
+_extractors = {}
+_lock = threading.Lock()
+
+
+def get_extractor(model_name=DEFAULT_MODEL, threshold=None, **encoder_options):
+    """
+    Экстрактор, загружаемый один раз на процесс для каждой модели
+    """
+    key = (model_name, threshold, tuple(sorted(encoder_options.items())))
+    extractor = _extractors.get(key)
+    if extractor is None:
+        with _lock:
+            extractor = _extractors.get(key)
+            if extractor is None:
+                if model_name == STUB_MODEL:
+                    encoder, default_threshold = StubEncoder(), STUB_THRESHOLD
+                else:
+                    encoder, default_threshold = TransformerEncoder(model_name, **encoder_options), DEFAULT_THRESHOLD
+                extractor = ComplaintExtractor(encoder, threshold=threshold or default_threshold)
+                _extractors[key] = extractor
+    return extractor
+
+
+_FILLERS = ("жалуется на", "беспокоит", "отмечает", "в течение двух дней", "со слов пациента", "выраженная")
+
+
+def synthetic_notes(count, seed=0):
+    rng = np.random.default_rng(seed)
+    notes = []
+    for _ in range(count):
+        chosen = rng.choice(len(SYMPTOMS), size=int(rng.integers(1, 5)), replace=False)
+        parts = [f"{rng.choice(_FILLERS)} {SYMPTOMS[i].lower()}" for i in chosen]
+        notes.append(", ".join(parts) + ".")
+    return notes
+
+
+def benchmark(extractor, notes=1000, batch_size=DEFAULT_BATCH_SIZE, seed=0):
+    """
+    Пропускная способность извлечения, жалоб в секунду
+    """
+    corpus = synthetic_notes(notes, seed)
+    extractor.extract_batch(corpus[:batch_size])  # прогрев
+    started = time.perf_counter()
+    for start in range(0, len(corpus), batch_size):
+        extractor.extract_batch(corpus[start:start + batch_size])
+    elapsed = time.perf_counter() - started
+    print(f"Модель {extractor.encoder.model_name}: {notes} жалоб за {elapsed:.2f} с, {notes / elapsed:,.1f} жалоб/с")
+    return notes / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Извлечение симптомов из жалоб в свободной форме")
+    parser.add_argument("notes", nargs="*", help="Тексты жалоб")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--stub", action="store_true", help="Детерминированная заглушка вместо модели")
+    parser.add_argument("--threshold", type=float)
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("--no-quantize", action="store_true")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--count", type=int, default=1000, help="Жалоб в замере")
+    args = parser.parse_args(argv)
+
+    if args.stub:
+        extractor = get_extractor(STUB_MODEL, args.threshold)
+    else:
+        extractor = get_extractor(args.model, args.threshold, num_threads=args.threads, quantize=not args.no_quantize)
+    extractor.batch_size = args.batch_size
+
+    if args.benchmark:
+        benchmark(extractor, args.count, args.batch_size)
+    for note, found in zip(args.notes, extractor.extract_batch(args.notes)):
+        print(f"{note}\n  -> {', '.join(found) or '(ничего не найдено)'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from instrumentation import timed
+from knowledge_base import get_knowledge_base
+from vocabulary import FEATURE_BITS, encode_patient, encode_patients, popcount
+
+# ДИАГНОСТИЧЕСКАЯ СИСТЕМА
+# Эталонная реализация правил; приложение и пакетные режимы используют правила
+# из базы знаний (diagnose, medical_diagnosis_batch), результаты совпадают
+@timed("medical_diagnosis_system")
+def medical_diagnosis_system(symptoms, lab_data, vital_signs, temperature, bp_systolic, bp_diastolic, wbc, crp):
+    """
+    Умная диагностическая система на основе баллов
+    """
+    symptom_score = {}
+    
+    # Проверяем критические состояния первыми
+    if bp_systolic > 180 and bp_diastolic > 120:
+        if any(symptom in ["Головная боль", "Тошнота", "Нарушение зрения", "Одышка", "Боль в груди"] for symptom in symptoms):
+            return "hypertensive_crisis", 10
+    
+    # Определяем лабораторные показатели
+    has_leukocytosis = "Лейкоцитоз" in lab_data or wbc > 10.0
+    has_elevated_crp = "Повышение СРБ" in lab_data or crp > 5.0
+    has_urinary_leuko = "Лейкоциты в моче" in lab_data
+    
+    # Пневмония
+    pneumonia_score = sum([
+        2 if "Лихорадка >38°C" in symptoms and temperature > 38 else 0,
+        2 if "Кашель с мокротой" in symptoms else 1 if "Кашель" in symptoms else 0,
+        2 if "Одышка" in symptoms else 0,
+        2 if "Боль в груди" in symptoms else 0,
+        2 if has_leukocytosis else 0,
+        2 if has_elevated_crp else 0
+    ])
+    symptom_score["community_acquired_pneumonia"] = pneumonia_score
+    
+    # Ангина
+    pharyngitis_score = sum([
+        2 if "Боль в горле" in symptoms else 0,
+        2 if "Налеты на миндалинах" in symptoms else 0,
+        2 if "Лихорадка >38°C" in symptoms and temperature > 38 else 0,
+        2 if "Увеличение лимфоузлов" in symptoms else 0,
+        -2 if "Кашель" in symptoms else 1,
+        1 if "Головная боль" in symptoms else 0
+    ])
+    symptom_score["streptococcal_pharyngitis"] = pharyngitis_score
+    
+    # ИМП
+    uti_score = sum([
+        3 if "Дизурия" in symptoms else 0,
+        2 if "Учащенное мочеиспускание" in symptoms else 0,
+        2 if "Боль в надлобковой области" in symptoms else 0,
+        2 if has_urinary_leuko else 0,
+        2 if "Лихорадка >38°C" in symptoms and temperature > 38 else 0
+    ])
+    symptom_score["urinary_tract_infection"] = uti_score
+    
+    # Бронхит
+    bronchitis_score = sum([
+        2 if "Кашель" in symptoms else 0,
+        2 if "Кашель с мокротой" in symptoms else 0,
+        -2 if "Лихорадка >38°C" in symptoms and temperature > 38 else 1,
+        -2 if "Одышка" in symptoms else 1,
+        -2 if has_leukocytosis else 1,
+        1 if "Слабость" in symptoms else 0
+    ])
+    symptom_score["acute_bronchitis"] = bronchitis_score
+    
+    # Грипп
+    influenza_score = sum([
+        2 if "Лихорадка >38°C" in symptoms and temperature > 38 else 0,
+        2 if "Головная боль" in symptoms else 0,
+        2 if "Мышечные боли" in symptoms else 0,
+        2 if "Слабость" in symptoms else 0,
+        2 if "Внезапное начало" in symptoms else 0,
+        1 if "Сезонность" in symptoms else 0
+    ])
+    symptom_score["influenza"] = influenza_score
+    
+    # Гастроэнтерит
+    gastroenteritis_score = sum([
+        3 if "Тошнота" in symptoms else 0,
+        3 if "Рвота" in symptoms else 0,
+        3 if "Диарея" in symptoms else 0,
+        2 if "Боль в животе" in symptoms else 0,
+        1 if "Слабость" in symptoms else 0,
+        1 if "Субфебрильная температура" in symptoms and 37 < temperature < 38 else 0
+    ])
+    symptom_score["acute_gastroenteritis"] = gastroenteritis_score
+    
+    # Мигрень
+    migraine_score = sum([
+        3 if "Пульсирующая головная боль" in symptoms else 0,
+        2 if "Односторонняя локализация" in symptoms else 0,
+        2 if "Тошнота/рвота" in symptoms else 0,
+        2 if "Фоно/фотофобия" in symptoms else 0,
+        3 if "Аура" in symptoms else 0
+    ])
+    symptom_score["migraine"] = migraine_score
+    
+    # Аллергический ринит
+    rhinitis_score = sum([
+        2 if "Чихание" in symptoms else 0,
+        2 if "Ринорея" in symptoms else 0,
+        2 if "Заложенность носа" in symptoms else 0,
+        2 if "Зуд в носу" in symptoms else 0,
+        2 if "Слезотечение" in symptoms else 0,
+        1 if "Сезонность" in symptoms else 0
+    ])
+    symptom_score["allergic_rhinitis"] = rhinitis_score
+    
+    # Находим наиболее вероятный диагноз
+    sorted_diagnoses = sorted(symptom_score.items(), key=lambda x: x[1], reverse=True)
+    
+    return sorted_diagnoses[0][0], sorted_diagnoses
+
+
+# Значения показателей по умолчанию (совпадают с начальными значениями формы в app.py)
+DEFAULT_VITALS = {
+    "temperature": 37.0,
+    "bp_systolic": 120,
+    "bp_diastolic": 80,
+    "wbc": 6.0,
+    "crp": 2.0,
+}
+
+# ПАКЕТНАЯ (ВЕКТОРИЗОВАННАЯ) ДИАГНОСТИКА
+# Те же правила, что и в medical_diagnosis_system, но взятые из базы знаний и
+# вычисляемые над битовыми масками из vocabulary.py: каждое слагаемое
+# "a if условие else b" превращается в базу b и вес (a - b), а баллы считаются
+# как AND с маской правил и подсчет битов.
+
+
+def _bit(bitsets, name):
+    return (bitsets >> np.uint64(FEATURE_BITS[name])) & np.uint64(1) == 1
+
+
+def _flag(condition, name):
+    return condition.astype(np.uint64) << np.uint64(FEATURE_BITS[name])
+
+
+def add_derived_features(bitsets, temperature, wbc, crp, thresholds=None):
+    """
+    Дописывает в маски биты производных признаков (лихорадка с учетом температуры, лейкоцитоз и т.д.)
+    """
+    thresholds = thresholds or get_knowledge_base().thresholds
+    bitsets = np.asarray(bitsets, dtype=np.uint64)
+    temperature = np.asarray(temperature, dtype=np.float64)
+    wbc = np.asarray(wbc, dtype=np.float64)
+    crp = np.asarray(crp, dtype=np.float64)
+    fever_temp = thresholds["fever_temperature"]
+    subfebrile_temp = thresholds["subfebrile_temperature"]
+
+    return (
+        bitsets
+        | _flag(_bit(bitsets, "Лихорадка >38°C") & (temperature > fever_temp), "fever")
+        | _flag(
+            _bit(bitsets, "Субфебрильная температура") & (temperature > subfebrile_temp) & (temperature < fever_temp),
+            "subfebrile",
+        )
+        | _flag(_bit(bitsets, "Лейкоцитоз") | (wbc > thresholds["wbc"]), "leukocytosis")
+        | _flag(_bit(bitsets, "Повышение СРБ") | (crp > thresholds["crp"]), "elevated_crp")
+        | _flag(_bit(bitsets, "Лейкоциты в моче"), "urinary_leukocytes")
+        | _flag(_bit(bitsets, "Кашель") & ~_bit(bitsets, "Кашель с мокротой"), "cough_without_sputum")
+    )
+
+
+# Биты находок и производных признаков для оценки одного пациента
+_FEVER = 1 << FEATURE_BITS["Лихорадка >38°C"]
+_SUBFEBRILE = 1 << FEATURE_BITS["Субфебрильная температура"]
+_LEUKOCYTOSIS = 1 << FEATURE_BITS["Лейкоцитоз"]
+_ELEVATED_CRP = 1 << FEATURE_BITS["Повышение СРБ"]
+_URINARY_LEUKOCYTES = 1 << FEATURE_BITS["Лейкоциты в моче"]
+_COUGH = 1 << FEATURE_BITS["Кашель"]
+_PRODUCTIVE_COUGH = 1 << FEATURE_BITS["Кашель с мокротой"]
+_DERIVED = {
+    name: 1 << FEATURE_BITS[name]
+    for name in ("fever", "subfebrile", "leukocytosis", "elevated_crp", "urinary_leukocytes", "cough_without_sputum")
+}
+
+
+def derived_feature_bits(bits, temperature, wbc, crp, thresholds):
+    """
+    То же, что add_derived_features, для одного пациента без накладных расходов NumPy
+    """
+    bits = int(bits)
+    derived = 0
+    if bits & _FEVER and temperature > thresholds["fever_temperature"]:
+        derived |= _DERIVED["fever"]
+    if bits & _SUBFEBRILE and thresholds["subfebrile_temperature"] < temperature < thresholds["fever_temperature"]:
+        derived |= _DERIVED["subfebrile"]
+    if bits & _LEUKOCYTOSIS or wbc > thresholds["wbc"]:
+        derived |= _DERIVED["leukocytosis"]
+    if bits & _ELEVATED_CRP or crp > thresholds["crp"]:
+        derived |= _DERIVED["elevated_crp"]
+    if bits & _URINARY_LEUKOCYTES:
+        derived |= _DERIVED["urinary_leukocytes"]
+    if bits & _COUGH and not bits & _PRODUCTIVE_COUGH:
+        derived |= _DERIVED["cough_without_sputum"]
+    return bits | derived
+
+
+def override_mask(bitsets, bp_systolic, bp_diastolic, kb=None):
+    """
+    Пациенты, у которых срабатывает приоритетное правило (гипертонический криз)
+    """
+    kb = kb if kb is not None else get_knowledge_base()
+    bitsets = np.asarray(bitsets, dtype=np.uint64)
+    if kb.override_column is None:
+        return np.zeros(bitsets.shape, dtype=bool)
+    return (
+        (np.asarray(bp_systolic) > kb.thresholds["bp_systolic"])
+        & (np.asarray(bp_diastolic) > kb.thresholds["bp_diastolic"])
+        & (bitsets & kb.override_mask != 0)
+    )
+
+
+def rule_scores(feature_bitsets, kb=None):
+    """
+    Матрица баллов N × len(kb) по маскам с производными признаками
+    """
+    kb = kb if kb is not None else get_knowledge_base()
+    feature_bitsets = np.asarray(feature_bitsets, dtype=np.uint64)[:, None]
+    shape = (feature_bitsets.shape[0], len(kb))
+    scores = np.empty(shape, dtype=np.int16)
+    scores[:] = kb.rule_base
+    matched = np.empty(shape, dtype=np.uint64)
+    for weight, masks in kb.rule_masks.items():
+        np.bitwise_and(feature_bitsets, masks, out=matched)
+        scores += popcount(matched).astype(np.int16) * np.int16(weight)
+    return scores
+
+
+@dataclass
+class BatchDiagnosis:
+    """
+    Результат пакетной диагностики: матрица баллов (или вероятностей) N × len(conditions) и ранжирование
+    """
+    scores: np.ndarray
+    ranking: np.ndarray
+    crisis: np.ndarray
+    conditions: tuple
+    override_column: int = None
+    override_score: int = None
+
+    def __len__(self):
+        return self.scores.shape[0]
+
+    def main_diagnoses(self):
+        return [self.conditions[i] for i in self.ranking[:, 0]]
+
+    def ranked(self, i):
+        """
+        Отсортированный список (состояние, баллы) для пациента i без приоритетного состояния
+        """
+        return [
+            (self.conditions[col], self.scores[i, col].item())
+            for col in self.ranking[i]
+            if col != self.override_column
+        ]
+
+    def result(self, i):
+        """
+        Результат для пациента i в формате medical_diagnosis_system
+        """
+        if self.crisis[i]:
+            return self.conditions[self.override_column], self.override_score
+        ranked = self.ranked(i)
+        return ranked[0][0], ranked
+
+
+@timed("batch_scoring")
+def score_bitsets(bitsets, temperature, bp_systolic, bp_diastolic, wbc, crp, kb=None):
+    """
+    Векторизованный расчет баллов по битовым маскам симптомов и анализов
+    """
+    kb = kb if kb is not None else get_knowledge_base()
+    scores = rule_scores(add_derived_features(bitsets, temperature, wbc, crp, kb.thresholds), kb)
+    crisis = override_mask(bitsets, bp_systolic, bp_diastolic, kb)
+
+    # Приоритетное состояние всегда первое при срабатывании и исключается из
+    # ранжирования иначе; стабильная сортировка сохраняет порядок базы при равных баллах
+    sort_key = scores.astype(np.float64)
+    column = kb.override_column
+    if column is not None:
+        scores[:, column] = np.where(crisis, kb.override_score, 0)
+        sort_key[:, column] = np.where(crisis, np.inf, -np.inf)
+    ranking = np.argsort(-sort_key, axis=1, kind="stable")
+    return BatchDiagnosis(
+        scores=scores, ranking=ranking, crisis=crisis, conditions=kb.condition_names,
+        override_column=column, override_score=kb.override_score,
+    )
+
+
+def medical_diagnosis_batch(symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, kb=None):
+    """
+    Пакетная диагностика N пациентов за один проход NumPy
+    """
+    return score_bitsets(encode_patients(symptoms, lab_data), temperature, bp_systolic, bp_diastolic, wbc, crp, kb)
+
+
+@timed("scoring")
+def diagnose(symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, kb=None, top=None):
+    """
+    Диагностика одного пациента по инвертированному индексу базы знаний.
+    Возвращает результат в формате medical_diagnosis_system; top ограничивает длину списка.
+    """
+    kb = kb if kb is not None else get_knowledge_base()
+    bits = encode_patient(symptoms, lab_data)
+    if kb.is_override(bits, bp_systolic, bp_diastolic):
+        return kb.override_condition, kb.override_score
+    feature_bits = derived_feature_bits(bits, temperature, wbc, crp, kb.thresholds)
+    ranked = kb.ranked(feature_bits, top)
+    return ranked[0][0], ranked
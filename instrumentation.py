@@ -0,0 +1,307 @@
+"""
+Инструментирование горячего пути (включается явно)
+
+Таймеры этапов (диагностика, база знаний, кэш, модель жалоб, отрисовка
+лечения, перерисовка страницы), счетчики событий, показатели кэша и число
+активных сессий. Метрики отдаются в текстовом формате Prometheus, последние
+трассировки запросов - в JSON.
+
+    DIAGNOSIS_METRICS=1 streamlit run app.py
+    curl http://127.0.0.1:9464/metrics
+    curl http://127.0.0.1:9464/traces
+
+Без DIAGNOSIS_METRICS (или enable()) каждый таймер стоит одной проверки флага.
+"""
+import collections
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import warnings
+
+DEFAULT_PORT = int(os.environ.get("DIAGNOSIS_METRICS_PORT", 9464))
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+SESSION_TIMEOUT_SECONDS = 300
+TRACE_HISTORY = 100
+
+_enabled = os.environ.get("DIAGNOSIS_METRICS", "") not in ("", "0")
+_NOOP = contextlib.nullcontext()
+_current_trace = contextvars.ContextVar("diagnosis_trace", default=None)
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+class Trace:
+    """
+    Этапы одного запроса: (этап, начало от начала запроса в мс, длительность в мс, вложенность)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.wall_time = time.time()
+        self.spans = []
+        self.depth = 0
+        self.duration_ms = None
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "timestamp": self.wall_time,
+            "duration_ms": self.duration_ms,
+            "spans": [
+                {"stage": stage, "start_ms": round(start, 3), "duration_ms": round(duration, 3), "depth": depth}
+                for stage, start, duration, depth in sorted(self.spans, key=lambda span: span[1])
+            ],
+        }
+
+    def dumps(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+
+class _Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}  # этап -> [число вызовов, сумма секунд, счетчики по BUCKETS]
+        self.events = collections.Counter()
+        self.sessions = {}
+        self.collectors = {}
+        self.traces = collections.deque(maxlen=TRACE_HISTORY)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = [0, 0.0, [0] * len(BUCKETS)]
+            entry[0] += 1
+            entry[1] += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry[2][i] += 1
+                    break
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+            self.events.clear()
+            self.sessions.clear()
+            self.traces.clear()
+
+
+_registry = _Registry()
+
+
+class _Stage:
+    __slots__ = ("name", "started", "trace")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = _current_trace.get()
+        if self.trace is not None:
+            self.trace.depth += 1
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        finished = time.perf_counter()
+        _registry.observe(self.name, finished - self.started)
+        trace = self.trace
+        if trace is not None:
+            trace.depth -= 1
+            trace.spans.append((
+                self.name, (self.started - trace.started) * 1000, (finished - self.started) * 1000, trace.depth,
+            ))
+        return False
+
+
+def stage(name):
+    """
+    Контекстный менеджер таймера этапа
+    """
+    return _Stage(name) if _enabled else _NOOP
+
+
+def timed(name):
+    """
+    Декоратор таймера этапа
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(event, value=1):
+    if _enabled:
+        with _registry.lock:
+            _registry.events[event] += value
+
+
+def touch_session(session_id):
+    """
+    Отмечает активность сессии; активными считаются сессии, обращавшиеся за последние SESSION_TIMEOUT_SECONDS
+    """
+    if _enabled and session_id is not None:
+        now = time.monotonic()
+        with _registry.lock:
+            _registry.sessions[session_id] = now
+
+
+def active_sessions():
+    cutoff = time.monotonic() - SESSION_TIMEOUT_SECONDS
+    with _registry.lock:
+        for session_id in [key for key, seen in _registry.sessions.items() if seen < cutoff]:
+            del _registry.sessions[session_id]
+        return len(_registry.sessions)
+
+
+def register_collector(name, collect):
+    """
+    collect() -> {показатель: число}; вызывается только при чтении метрик (например, статистика кэша)
+    """
+    _registry.collectors[name] = collect
+
+
+@contextlib.contextmanager
+def trace(name="request"):
+    """
+    Трассировка одного запроса; при выключенных метриках возвращает None
+    """
+    if not _enabled:
+        yield None
+        return
+    current = Trace(name)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        current.duration_ms = round((time.perf_counter() - current.started) * 1000, 3)
+        _registry.traces.append(current)
+
+
+def recent_traces():
+    return [item.to_dict() for item in list(_registry.traces)]
+
+
+def reset():
+    _registry.reset()
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus():
+    """
+    Все метрики в текстовом формате Prometheus
+    """
+    with _registry.lock:
+        stages = {name: (calls, total, list(buckets)) for name, (calls, total, buckets) in _registry.stages.items()}
+        events = dict(_registry.events)
+    lines = [
+        "# HELP diagnosis_stage_seconds Длительность этапов обработки",
+        "# TYPE diagnosis_stage_seconds histogram",
+    ]
+    for name, (calls, total, buckets) in sorted(stages.items()):
+        label = _label(name)
+        cumulative = 0
+        for bound, hits in zip(BUCKETS, buckets):
+            cumulative += hits
+            lines.append(f'diagnosis_stage_seconds_bucket{{stage="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'diagnosis_stage_seconds_bucket{{stage="{label}",le="+Inf"}} {calls}')
+        lines.append(f'diagnosis_stage_seconds_sum{{stage="{label}"}} {total:.9f}')
+        lines.append(f'diagnosis_stage_seconds_count{{stage="{label}"}} {calls}')
+
+    lines += ["# HELP diagnosis_events_total Счетчики событий", "# TYPE diagnosis_events_total counter"]
+    for name, value in sorted(events.items()):
+        lines.append(f'diagnosis_events_total{{event="{_label(name)}"}} {value}')
+
+    lines += [
+        "# HELP diagnosis_active_sessions Сессии с активностью за последние 5 минут",
+        "# TYPE diagnosis_active_sessions gauge",
+        f"diagnosis_active_sessions {active_sessions()}",
+    ]
+    for collector, collect in sorted(_registry.collectors.items()):
+        try:
+            values = collect()
+        except Exception as e:  # сбой одного источника не должен ломать отдачу метрик
+            warnings.warn(f"Метрики {collector} недоступны: {e}")
+            continue
+        for key, value in sorted(values.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metric = f"diagnosis_{collector}_{key}"
+                lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+# http.server импортируется только при запуске сервера метрик: импорт модуля остается дешевым
+@functools.lru_cache(maxsize=None)
+def _metrics_handler():
+    from http.server import BaseHTTPRequestHandler
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = render_prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/traces":
+                body = json.dumps(recent_traces(), ensure_ascii=False).encode("utf-8")
+                content_type = "application/json; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return _MetricsHandler
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=DEFAULT_PORT, host="127.0.0.1"):
+    """
+    Фоновый HTTP-сервер /metrics и /traces (один на процесс); None, если порт занят
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            from http.server import ThreadingHTTPServer
+
+            try:
+                _server = ThreadingHTTPServer((host, port), _metrics_handler())
+            except OSError as e:
+                warnings.warn(f"Сервер метрик не запущен на {host}:{port}: {e}")
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="diagnosis-metrics", daemon=True).start()
+        return _server
@@ -0,0 +1,402 @@
+"""
+База знаний: загрузка из knowledge_base.json, компиляция и горячая перезагрузка
+
+Формат файла:
+    version     - версия базы (попадает в результаты и журналы)
+    thresholds  - пороги температуры, лейкоцитов, СРБ и АД
+    override    - приоритетное правило (гипертонический криз): состояние, баллы
+                  и симптомы, любой из которых вместе с высоким АД его запускает
+    conditions  - состояния с критериями, лечением и правилами "scoring":
+                  [признак, баллы если есть, баллы если нет]; признак - название
+                  находки из vocabulary.py или производный признак (fever и т.д.)
+
+При загрузке правила компилируются в маски для пакетной оценки и в
+инвертированный индекс "признак -> состояния", поэтому оценка одного пациента
+в большой базе затрагивает только состояния, у которых есть общий с ним
+признак. Небольшая база (до PYTHON_SCORING_LIMIT состояний) оценивается для
+одного пациента простым циклом по правилам: накладные расходы NumPy на
+нескольких состояниях больше самого расчета. Там же
+один раз готовятся панели лечения для интерфейса (treatment_markdown).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import warnings
+
+import numpy as np
+
+from instrumentation import count, timed
+from vocabulary import DERIVED_BITS, FEATURE_BITS, FINDING_IDS, mask
+
+DEFAULT_PATH = os.environ.get(
+    "KNOWLEDGE_BASE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge_base.json"),
+)
+
+# До этого числа состояний один пациент оценивается циклом Python, а не по индексу NumPy
+PYTHON_SCORING_LIMIT = 64
+REQUIRED_THRESHOLDS = ("fever_temperature", "subfebrile_temperature", "wbc", "crp", "bp_systolic", "bp_diastolic")
+
+# Порядок и заголовки разделов лечения в интерфейсе: (ключ, заголовок, показывать без назначений)
+TREATMENT_SECTIONS = (
+    ("antibiotics", "Антибактериальная терапия", False),
+    ("antivirals", "Противовирусная терапия", False),
+    ("antihistamines", "Антигистаминные препараты", False),
+    ("rehydration", "Регидратация", False),
+    ("emergency", "Неотложная помощь", False),
+    ("acute", "Купирование острого приступа", False),
+    ("symptomatic", "Симптоматическое лечение", True),
+    ("supportive", "Вспомогательная терапия", True),
+    ("diet", "Диетические рекомендации", False),
+    ("nasal", "Назальная терапия", False),
+    ("avoidance", "Элиминационные мероприятия", False),
+)
+
+
+def treatment_plan(info):
+    """
+    Разделы лечения состояния в порядке TREATMENT_SECTIONS: ((заголовок, (назначения, ...)), ...)
+    """
+    treatments = info["treatments"]
+    return tuple(
+        (title, tuple(treatments.get(key, ())))
+        for key, title, always_shown in TREATMENT_SECTIONS
+        if always_shown or key in treatments
+    )
+
+
+def treatment_markdown(info):
+    """
+    План лечения одним блоком Markdown (готовится один раз при загрузке базы знаний)
+    """
+    return "\n\n".join(
+        "\n".join([f"**{title}:**", "", *(f"- {item}" for item in items)]) if items else f"**{title}:**"
+        for title, items in treatment_plan(info)
+    )
+
+
+class KnowledgeBaseError(ValueError):
+    pass
+
+
+def _is_weight(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _parse_rules(name, info):
+    """
+    Правила состояния [(признак, баллы если есть, баллы если нет), ...]; ошибка формата - KnowledgeBaseError
+    """
+    if not isinstance(info, dict):
+        raise KnowledgeBaseError(f"{name}: описание состояния должно быть объектом")
+    scoring = info.get("scoring", [])
+    if not isinstance(scoring, list):
+        raise KnowledgeBaseError(f"{name}: scoring должен быть списком правил")
+    rules = []
+    for rule in scoring:
+        if not isinstance(rule, list) or len(rule) != 3:
+            raise KnowledgeBaseError(f"{name}: правило должно быть [признак, баллы если есть, баллы если нет]: {rule}")
+        feature, if_present, if_absent = rule
+        if not isinstance(feature, str) or feature not in FEATURE_BITS:
+            raise KnowledgeBaseError(f"{name}: неизвестный признак в правиле: {feature}")
+        if not (_is_weight(if_present) and _is_weight(if_absent)):
+            raise KnowledgeBaseError(f"{name}: баллы правила {feature} должны быть целыми числами: {rule}")
+        rules.append((feature, if_present, if_absent))
+    if not isinstance(info.get("treatments", {}), dict):
+        raise KnowledgeBaseError(f"{name}: treatments должен быть объектом")
+    return rules
+
+
+def _set_bits(bits):
+    bits = int(bits)
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class KnowledgeBase:
+    """
+    Скомпилированная база знаний; после создания не изменяется и может разделяться между сессиями
+    """
+
+    def __init__(self, data, path=None, checksum=None, mtime=None):
+        self.path = path
+        self.mtime = mtime
+        self.checksum = checksum
+        self.version = str(data.get("version", ""))
+        self.conditions = data["conditions"]
+        if not isinstance(self.conditions, dict):
+            raise KnowledgeBaseError("conditions должен быть объектом {состояние: описание}")
+        self.condition_names = tuple(self.conditions)
+
+        thresholds = data.get("thresholds", {})
+        missing = [name for name in REQUIRED_THRESHOLDS if name not in thresholds]
+        if missing:
+            raise KnowledgeBaseError(f"Не заданы пороги: {', '.join(missing)}")
+        invalid = [name for name in REQUIRED_THRESHOLDS
+                   if isinstance(thresholds[name], bool) or not isinstance(thresholds[name], (int, float))]
+        if invalid:
+            raise KnowledgeBaseError(f"Пороги должны быть числами: {', '.join(invalid)}")
+        self.thresholds = thresholds
+
+        column = {name: i for i, name in enumerate(self.condition_names)}
+        override = data.get("override")
+        if override:
+            if not isinstance(override, dict) or not isinstance(override.get("any_of"), list):
+                raise KnowledgeBaseError("override должен быть объектом с condition, score и списком any_of")
+            if override["condition"] not in column:
+                raise KnowledgeBaseError(f"Неизвестное состояние в override: {override['condition']}")
+            if not _is_weight(override["score"]):
+                raise KnowledgeBaseError(f"Баллы override должны быть целым числом: {override['score']}")
+            unknown = [item for item in override["any_of"] if item not in FINDING_IDS]
+            if unknown:
+                raise KnowledgeBaseError(f"Неизвестные находки в override: {', '.join(map(str, unknown))}")
+            self.override_condition = override["condition"]
+            self.override_column = column[override["condition"]]
+            self.override_score = override["score"]
+            self.override_mask = mask(override["any_of"])
+        else:
+            self.override_condition = self.override_column = self.override_score = None
+            self.override_mask = np.uint64(0)
+
+        self.rules = {name: _parse_rules(name, info) for name, info in self.conditions.items()}
+
+        # Панели лечения для интерфейса: одна Markdown-строка на состояние
+        self.treatment_markdown = {name: treatment_markdown(info) for name, info in self.conditions.items()}
+
+        self.rule_base, self.rule_masks = self._compile_masks()
+        self.index = self._compile_index()
+        # Приоритетное состояние не участвует в ранжировании по баллам
+        self.ranked_columns = np.array(
+            [col for col in range(len(self.condition_names)) if col != self.override_column], dtype=np.intp
+        )
+        self.python_rules = self._compile_python_rules() if len(self.condition_names) <= PYTHON_SCORING_LIMIT else None
+        self._freeze()
+
+    def _freeze(self):
+        """
+        Скомпилированные массивы только для чтения: база разделяется всеми сессиями процесса
+        """
+        arrays = [self.rule_base, self.ranked_columns, *self.rule_masks.values()]
+        arrays += [array for posting in self.index.values() for array in posting]
+        for array in arrays:
+            array.flags.writeable = False
+
+    def _compile_masks(self):
+        """
+        Вектор базовых баллов и маски признаков по каждому весу: {вес: массив масок uint64 по состояниям}
+        """
+        base = np.zeros(len(self.condition_names), dtype=np.int16)
+        weight_bits = {}
+        for col, name in enumerate(self.condition_names):
+            for feature, if_present, if_absent in self.rules[name]:
+                base[col] += if_absent
+                bits = weight_bits.setdefault(if_present - if_absent, [0] * len(self.condition_names))
+                bits[col] |= 1 << FEATURE_BITS[feature]
+        masks = {weight: np.array(bits, dtype=np.uint64) for weight, bits in sorted(weight_bits.items()) if weight}
+        return base, masks
+
+    def _compile_index(self):
+        """
+        Инвертированный индекс: бит признака -> (столбцы состояний, прибавка баллов)
+        """
+        postings = {}
+        for col, name in enumerate(self.condition_names):
+            for feature, if_present, if_absent in self.rules[name]:
+                weight = if_present - if_absent
+                if weight:
+                    entry = postings.setdefault(FEATURE_BITS[feature], {})
+                    entry[col] = entry.get(col, 0) + weight
+        index = {
+            bit: (np.fromiter(entry, dtype=np.intp), np.fromiter(entry.values(), dtype=np.int16))
+            for bit, entry in postings.items()
+        }
+        return index
+
+    def _compile_python_rules(self):
+        """
+        Маски правил в виде чисел Python для ранжируемых состояний в порядке базы:
+        (состояние, базовые баллы, ((маска признаков, вес), ...)) - те же маски, что у пакетной оценки
+        """
+        return tuple(
+            (
+                self.condition_names[col],
+                int(self.rule_base[col]),
+                tuple((int(masks[col]), weight) for weight, masks in self.rule_masks.items() if masks[col]),
+            )
+            for col in self.ranked_columns
+        )
+
+    def __len__(self):
+        return len(self.condition_names)
+
+    def __getitem__(self, name):
+        return self.conditions[name]
+
+    def __contains__(self, name):
+        return name in self.conditions
+
+    def is_override(self, feature_bits, bp_systolic, bp_diastolic):
+        return (
+            self.override_column is not None
+            and bp_systolic > self.thresholds["bp_systolic"]
+            and bp_diastolic > self.thresholds["bp_diastolic"]
+            and int(feature_bits) & int(self.override_mask) != 0
+        )
+
+    def feature_scores(self, feature_bits):
+        """
+        Баллы всех состояний для одного пациента: к базовым баллам добавляются только
+        списки состояний из индекса для признаков, которые есть у пациента
+        """
+        scores = self.rule_base.copy()
+        for bit in _set_bits(feature_bits):
+            posting = self.index.get(bit)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        return scores
+
+    def ranked(self, feature_bits, top=None):
+        """
+        Список (состояние, баллы) по убыванию баллов без приоритетного состояния;
+        при равенстве сохраняется порядок базы
+        """
+        if self.python_rules is not None:
+            bits = int(feature_bits)
+            scored = []
+            for name, score, rules in self.python_rules:
+                for rule_mask, weight in rules:
+                    if bits & rule_mask:
+                        score += weight * (bits & rule_mask).bit_count()
+                scored.append((name, score))
+            scored.sort(key=lambda item: -item[1])
+            return scored if top is None else scored[:max(top, 0)]
+
+        columns = self.ranked_columns
+        scores = self.feature_scores(feature_bits)[columns]
+
+        if top is None or top >= len(scores):
+            order = np.argsort(-scores, kind="stable")
+        else:
+            # Уникальный ключ: баллы по убыванию, затем порядок в базе
+            keys = np.arange(len(scores)) - scores.astype(np.int64) * len(scores)
+            order = np.partition(keys, top - 1)[:top] if top > 0 else keys[:0]
+            order = np.sort(order) % len(scores)
+        return [(self.condition_names[c], int(s)) for c, s in zip(columns[order], scores[order])]
+
+
+def load_knowledge_base(path=DEFAULT_PATH):
+    """
+    Читает и компилирует базу знаний из JSON-файла
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    mtime = os.stat(path).st_mtime_ns
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise KnowledgeBaseError(f"{path}: некорректный JSON: {e}") from e
+    return KnowledgeBase(data, path=path, checksum=hashlib.sha256(raw).hexdigest()[:12], mtime=mtime)
+
+
+_lock = threading.Lock()
+_current = None
+_rejected = None
+
+
+@timed("knowledge_base")
+def get_knowledge_base(path=None):
+    """
+    Текущая база знаний процесса; перечитывается при изменении файла.
+    Если новая версия файла содержит ошибку, продолжает работать предыдущая.
+    """
+    global _current, _rejected
+    path = path or DEFAULT_PATH
+    kb = _current
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        if kb is not None and kb.path == path:
+            return kb
+        raise
+    if kb is not None and kb.path == path and (kb.mtime == mtime or _rejected == (path, mtime)):
+        return kb
+
+    with _lock:
+        if _current is None or _current.path != path or _current.mtime != mtime:
+            try:
+                _current = load_knowledge_base(path)
+                count("knowledge_base_reloads")
+            except (OSError, KnowledgeBaseError, KeyError) as e:
+                if _current is None or _current.path != path:
+                    raise
+                if _rejected != (path, mtime):
+                    _rejected = (path, mtime)
+                    count("knowledge_base_rejected")
+                    warnings.warn(f"База знаний не перезагружена, используется версия {_current.version}: {e}")
+        return _current
+
+
+# Словарь состояний для совместимости со старым кодом (на момент импорта)
+MEDICAL_KNOWLEDGE_BASE = get_knowledge_base().conditions
+
+
+def synthetic_knowledge_base(n_conditions=5000, rules_per_condition=6, seed=0):
+    """
+    Случайная база знаний заданного размера для замеров производительности
+    """
+    rng = np.random.default_rng(seed)
+    features = list(FINDING_IDS) + list(DERIVED_BITS)
+    conditions = {}
+    for i in range(n_conditions):
+        chosen = rng.choice(len(features), size=rules_per_condition, replace=False)
+        conditions[f"condition_{i:05d}"] = {
+            "treatments": {},
+            "referral": "",
+            "source": "synthetic",
+            "scoring": [[features[j], int(rng.integers(1, 4)), 0] for j in chosen],
+        }
+    return {"version": f"synthetic-{n_conditions}", "thresholds": get_knowledge_base().thresholds, "conditions": conditions}
+
+
+def benchmark_lookup(n_conditions=5000, patients=10_000, findings_per_patient=6, seed=0):
+    """
+    Замеряет компиляцию синтетической базы и время оценки одного пациента по индексу
+    """
+    rng = np.random.default_rng(seed)
+    data = synthetic_knowledge_base(n_conditions, seed=seed)
+    started = time.perf_counter()
+    kb = KnowledgeBase(data)
+    compile_ms = (time.perf_counter() - started) * 1000
+
+    bits = list(FEATURE_BITS.values())
+    cohort = [
+        sum(1 << int(b) for b in rng.choice(bits, size=findings_per_patient, replace=False))
+        for _ in range(patients)
+    ]
+    timings = np.empty(patients)
+    for i, feature_bits in enumerate(cohort):
+        started = time.perf_counter()
+        kb.ranked(feature_bits, top=4)
+        timings[i] = time.perf_counter() - started
+    timings *= 1e6
+
+    print(f"Состояний: {n_conditions}, компиляция: {compile_ms:.1f} мс")
+    print(
+        f"Оценка пациента (топ-4): p50 {np.percentile(timings, 50):.0f} мкс, "
+        f"p99 {np.percentile(timings, 99):.0f} мкс, среднее {timings.mean():.0f} мкс"
+    )
+    return timings
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Замер поиска по инвертированному индексу базы знаний")
+    parser.add_argument("--conditions", type=int, default=5000)
+    parser.add_argument("--patients", type=int, default=10_000)
+    args = parser.parse_args()
+    benchmark_lookup(args.conditions, args.patients)
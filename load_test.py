@@ -0,0 +1,337 @@
+"""
+Нагрузочный тест: N одновременных пользователей отправляют форму диагностики
+
+Харнесс запускает локальный сервер Streamlit с app.py (или подключается к
+--url) и открывает по сессии на пользователя через тот же websocket-протокол,
+что и браузер. Каждый пользователь заполняет форму данными синтетического
+пациента (benchmarks.synthetic_cohort) и нажимает "Провести диагностику";
+время перерисовки - от отправки до окончания выполнения скрипта на сервере.
+
+Для каждого уровня нагрузки выводятся перцентили времени перерисовки и
+пропускная способность; точка насыщения - последний уровень, после которого
+пропускная способность растет меньше чем на --min-gain или p95 выходит за
+--max-p95-ms. Память сервера на сессию - прирост RSS процесса при открытии
+сессий, деленный на их число (Linux, /proc).
+
+    python load_test.py --users 1,2,4,8,16,32 --clicks 20
+    python load_test.py --url http://127.0.0.1:8501 --pid 12345 --users 8
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(ROOT, "app.py")
+DEFAULT_USERS = (1, 2, 4, 8, 16, 32)
+DEFAULT_CLICKS = 20
+DEFAULT_THINK_TIME = 0.05
+DEFAULT_MIN_GAIN = 0.1
+DEFAULT_MAX_P95_MS = 1000.0
+DEFAULT_MEMORY_SESSIONS = 100
+SERVER_START_TIMEOUT = 60
+
+# Подписи полей формы в app.py: по ним находятся идентификаторы виджетов
+FORM_LABELS = {
+    "symptoms": "Симптомы пациента:",
+    "temperature": "Температура тела (°C):",
+    "wbc": "Лейкоциты (×10⁹/л):",
+    "crp": "СРБ (мг/л):",
+    "lab_data": "Другие результаты анализов:",
+    "bp_systolic": "Систолическое (мм рт.ст.):",
+    "bp_diastolic": "Диастолическое (мм рт.ст.):",
+    "submit": "Провести диагностику",
+}
+
+
+class LoadTestError(RuntimeError):
+    pass
+
+
+# СЕРВЕР
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _healthy(url):
+    try:
+        with urllib.request.urlopen(f"{url}/_stcore/health", timeout=1) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+@contextlib.contextmanager
+def local_server(app_path=APP_PATH, port=None):
+    """
+    Сервер Streamlit в отдельном процессе (каталог приложения - рабочий, чтобы читался .streamlit/config.toml):
+    (url, pid). Журнал обращений пишется во временный файл.
+    """
+    port = port or _free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.setdefault("AUDIT_LOG_PATH", os.path.join(tmp, "audit_log.sqlite"))
+        process = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", app_path, "--server.headless", "true",
+             "--server.address", "127.0.0.1", "--server.port", str(port),
+             "--server.fileWatcherType", "none"],
+            cwd=os.path.dirname(os.path.abspath(app_path)), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        url = f"http://127.0.0.1:{port}"
+        try:
+            deadline = time.monotonic() + SERVER_START_TIMEOUT
+            while not _healthy(url):
+                if process.poll() is not None:
+                    raise LoadTestError(f"Сервер завершился при запуске: {process.stderr.read().decode()[-2000:]}")
+                if time.monotonic() > deadline:
+                    raise LoadTestError(f"Сервер не ответил за {SERVER_START_TIMEOUT} с")
+                time.sleep(0.2)
+            yield url, process.pid
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def rss_bytes(pid):
+    """
+    Резидентная память процесса (Linux); None, если недоступна
+    """
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, TypeError):
+        pass
+    return None
+
+
+# СЕССИЯ ПОЛЬЗОВАТЕЛЯ
+class Session:
+    """
+    Одна вкладка браузера: websocket-сессия Streamlit, отправляющая перерисовки с состояниями виджетов
+    """
+
+    def __init__(self, websocket):
+        self._websocket = websocket
+        self.widgets = {}   # подпись -> идентификатор виджета
+        self.errors = 0
+
+    @classmethod
+    async def open(cls, url):
+        from websockets.asyncio.client import connect
+
+        ws_url = url.replace("http://", "ws://").replace("https://", "wss://") + "/_stcore/stream"
+        return cls(await connect(ws_url, subprotocols=["streamlit"], max_size=None, open_timeout=30))
+
+    async def close(self):
+        await self._websocket.close()
+
+    async def rerun(self, widget_states=()):
+        """
+        Перерисовка страницы; возвращает время до окончания скрипта в секундах
+        """
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        message.rerun_script.widget_states.widgets.extend(widget_states)
+        started = time.perf_counter()
+        await self._websocket.send(message.SerializeToString())
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await self._websocket.recv())
+            kind = forward.WhichOneof("type")
+            if kind == "script_finished":
+                return time.perf_counter() - started
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                self._collect(forward.delta.new_element)
+
+    def _collect(self, element):
+        kind = element.WhichOneof("type")
+        if kind == "exception":
+            self.errors += 1
+            return
+        proto = getattr(element, kind)
+        widget_id = getattr(proto, "id", "")
+        if widget_id and getattr(proto, "label", ""):
+            self.widgets[proto.label] = widget_id
+
+    def form_states(self, symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp):
+        """
+        Состояния виджетов при нажатии кнопки формы с данными пациента
+        """
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        missing = [label for label in FORM_LABELS.values() if label not in self.widgets]
+        if missing:
+            raise LoadTestError(f"На странице нет полей формы: {', '.join(missing)}")
+        ids = {field: self.widgets[label] for field, label in FORM_LABELS.items()}
+        states = [
+            WidgetState(id=ids["symptoms"], string_array_value={"data": list(symptoms)}),
+            WidgetState(id=ids["lab_data"], string_array_value={"data": list(lab_data)}),
+            WidgetState(id=ids["temperature"], double_array_value={"data": [min(max(temperature, 35.0), 42.0)]}),
+            WidgetState(id=ids["wbc"], double_value=min(max(wbc, 1.0), 50.0)),
+            WidgetState(id=ids["crp"], double_value=min(max(crp, 0.0), 200.0)),
+            WidgetState(id=ids["bp_systolic"], double_value=min(max(bp_systolic, 80), 250)),
+            WidgetState(id=ids["bp_diastolic"], double_value=min(max(bp_diastolic, 50), 150)),
+            WidgetState(id=ids["submit"], trigger_value=True),
+        ]
+        return states
+
+
+async def _user(url, cohort, offset, clicks, think_time, ready, started, latencies, rng):
+    session = await Session.open(url)
+    try:
+        await session.rerun()
+        ready.release()
+        await started.wait()
+        for i in range(clicks):
+            await asyncio.sleep(rng.uniform(0, 2 * think_time))
+            patient = cohort.patient((offset + i) % len(cohort))
+            latencies.append(await session.rerun(session.form_states(*patient)))
+        return session.errors
+    finally:
+        await session.close()
+
+
+async def run_level(url, users, clicks, cohort, think_time=DEFAULT_THINK_TIME, seed=0):
+    """
+    users одновременных пользователей по clicks отправок формы: перцентили (мс) и пропускная способность
+    """
+    latencies = []
+    ready = asyncio.Semaphore(0)
+    started = asyncio.Event()
+    tasks = [
+        asyncio.create_task(_user(url, cohort, user * clicks, clicks, think_time, ready, started, latencies,
+                                  random.Random(seed + user)))
+        for user in range(users)
+    ]
+    # Отсчет начинается, когда все сессии открыты и первая страница отрисована
+    for _ in range(users):
+        await asyncio.wait_for(ready.acquire(), SERVER_START_TIMEOUT)
+    wall = time.perf_counter()
+    started.set()
+    errors = sum(await asyncio.gather(*tasks))
+    wall = time.perf_counter() - wall
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {
+        "users": users,
+        "reruns": len(latencies),
+        "errors": errors,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "throughput": len(latencies) / wall,
+    }
+
+
+async def session_memory(url, pid, sessions, cohort):
+    """
+    Прирост RSS сервера на одну открытую сессию после отправки формы, байт; None без /proc
+    """
+    warmup = await Session.open(url)
+    await warmup.rerun()
+    await warmup.rerun(warmup.form_states(*cohort.patient(0)))
+    await warmup.close()
+    await asyncio.sleep(0.5)
+    before = rss_bytes(pid)
+    opened = []
+    try:
+        for i in range(sessions):
+            session = await Session.open(url)
+            opened.append(session)
+            await session.rerun()
+            await session.rerun(session.form_states(*cohort.patient(i % len(cohort))))
+        after = rss_bytes(pid)
+    finally:
+        await asyncio.gather(*(session.close() for session in opened))
+    if before is None or after is None:
+        return None
+    return (after - before) / sessions
+
+
+def saturation_point(levels, min_gain=DEFAULT_MIN_GAIN, max_p95_ms=DEFAULT_MAX_P95_MS):
+    """
+    Наибольшее число пользователей, при котором пропускная способность еще растет и p95 в бюджете
+    """
+    point = None
+    best = 0.0
+    for level in levels:
+        if level["p95_ms"] > max_p95_ms:
+            break
+        if point is not None and level["throughput"] < best * (1 + min_gain):
+            break
+        point, best = level["users"], max(best, level["throughput"])
+    return point
+
+
+async def run_load_test(url, pid, users=DEFAULT_USERS, clicks=DEFAULT_CLICKS, think_time=DEFAULT_THINK_TIME,
+                        seed=0, memory_sessions=DEFAULT_MEMORY_SESSIONS):
+    from benchmarks import synthetic_cohort
+
+    cohort = synthetic_cohort(max(max(users) * clicks, memory_sessions), seed)
+    memory = await session_memory(url, pid, memory_sessions, cohort) if pid and memory_sessions else None
+    levels = []
+    for count in sorted(users):
+        level = await run_level(url, count, clicks, cohort, think_time, seed)
+        levels.append(level)
+        print(f"{count:>5} польз.: p50 {level['p50_ms']:8.1f} мс, p95 {level['p95_ms']:8.1f} мс, "
+              f"p99 {level['p99_ms']:8.1f} мс, {level['throughput']:7.1f} перерисовок/с"
+              + (f", ошибок {level['errors']}" if level["errors"] else ""), flush=True)
+    return {"session_memory_bytes": memory, "levels": levels}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест формы диагностики с N одновременными сессиями")
+    parser.add_argument("--users", default=",".join(map(str, DEFAULT_USERS)), help="Уровни нагрузки через запятую")
+    parser.add_argument("--clicks", type=int, default=DEFAULT_CLICKS, help="Отправок формы на пользователя")
+    parser.add_argument("--think-time", type=float, default=DEFAULT_THINK_TIME,
+                        help="Средняя пауза между отправками, с")
+    parser.add_argument("--url", help="Уже запущенный сервер (по умолчанию запускается локальный)")
+    parser.add_argument("--pid", type=int, help="PID сервера --url для замера памяти")
+    parser.add_argument("--memory-sessions", type=int, default=DEFAULT_MEMORY_SESSIONS,
+                        help="Сессий для замера памяти (0 - без замера); при малом числе прирост занижен")
+    parser.add_argument("--app", default=APP_PATH)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-gain", type=float, default=DEFAULT_MIN_GAIN)
+    parser.add_argument("--max-p95-ms", type=float, default=DEFAULT_MAX_P95_MS)
+    parser.add_argument("--json", action="store_true", help="Итог в JSON")
+    args = parser.parse_args(argv)
+    users = [int(value) for value in args.users.split(",") if value.strip()]
+
+    with contextlib.ExitStack() as stack:
+        url, pid = (args.url.rstrip("/"), args.pid) if args.url else stack.enter_context(local_server(args.app))
+        report = asyncio.run(
+            run_load_test(url, pid, users, args.clicks, args.think_time, args.seed, args.memory_sessions)
+        )
+    report["saturation_users"] = saturation_point(report["levels"], args.min_gain, args.max_p95_ms)
+
+    memory = report["session_memory_bytes"]
+    print(f"Память сервера на сессию: {memory / 1024:.0f} КБ" if memory is not None
+          else "Память сервера на сессию: недоступна (нужны --pid и /proc)")
+    saturation = report["saturation_users"]
+    print(f"Точка насыщения: {saturation} польз." if saturation else "Точка насыщения: не достигнута ни на одном уровне")
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
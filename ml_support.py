@@ -0,0 +1,42 @@
+"""
+Отложенная загрузка тяжелых ML-зависимостей (torch, transformers)
+
+Основное приложение и диагностика их не используют; пакеты ставятся отдельно:
+    pip install -r requirements-ml.txt
+и импортируются только при первом обращении к ML-функциям.
+"""
+import importlib
+import importlib.util
+
+ML_REQUIREMENTS = "requirements-ml.txt"
+ML_MODULES = ("torch", "transformers")
+
+
+class MLDependencyError(ImportError):
+    pass
+
+
+def ml_available():
+    """
+    Установлены ли ML-зависимости (без их импорта)
+    """
+    return all(importlib.util.find_spec(name) is not None for name in ML_MODULES)
+
+
+def require(module_name):
+    """
+    Импортирует модуль ML-стека или сообщает, как установить зависимости
+    """
+    try:
+        return importlib.import_module(module_name)
+    except ImportError as e:
+        raise MLDependencyError(
+            f"Для этой функции нужен пакет {module_name}: pip install -r {ML_REQUIREMENTS}"
+        ) from e
+
+
+def load_ml_stack():
+    """
+    Возвращает (torch, transformers); вызывается только ML-функциями
+    """
+    return require("torch"), require("transformers")
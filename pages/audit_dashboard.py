@@ -0,0 +1,75 @@
+"""
+Панель аналитики по журналу обращений (audit_log.py)
+
+Строится только по сводкам, которые обновляются при записи журнала, поэтому
+время отрисовки не зависит от числа обращений.
+"""
+import os
+
+import plotly.express as px
+import streamlit as st
+
+import audit_log
+
+st.set_page_config(page_title="Аналитика обращений", page_icon="📊", layout="wide")
+
+ENGINE_LABELS = {
+    "rules": "Баллы по правилам",
+    "bayes": "Вероятностная модель",
+    audit_log.OVERRIDE_ENGINE: "Приоритетное правило",
+}
+
+
+# Сводки кэшируются на короткое время: фоновая запись обновляет их не чаще раза в секунду
+@st.cache_data(ttl=10)
+def load_rollups(path):
+    return audit_log.read_rollups(path)
+
+
+def main():
+    st.title("Аналитика обращений")
+
+    if not os.path.exists(audit_log.DEFAULT_PATH):
+        st.info("Журнал обращений пока пуст: данные появятся после первой диагностики.")
+        return
+    daily, scores = load_rollups(audit_log.DEFAULT_PATH)
+    if daily.empty:
+        st.info("Журнал обращений пока пуст: данные появятся после первой диагностики.")
+        return
+
+    daily["condition"] = daily["condition"].str.replace("_", " ").str.title()
+    scores["condition"] = scores["condition"].str.replace("_", " ").str.title()
+
+    total = int(daily["count"].sum())
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Всего обращений", f"{total:,}")
+    col2.metric("Дней в журнале", daily["day"].nunique())
+    col3.metric("Состояний", daily["condition"].nunique())
+
+    # ОБРАЩЕНИЯ ПО ДНЯМ
+    st.subheader("Обращения по дням")
+    st.plotly_chart(
+        px.bar(daily, x="day", y="count", color="condition",
+               labels={"day": "День", "count": "Обращений", "condition": "Состояние"}),
+        use_container_width=True,
+    )
+
+    # РАСПРЕДЕЛЕНИЕ БАЛЛОВ
+    st.subheader("Распределение баллов по состояниям")
+    engine = st.radio(
+        "Метод оценки:", sorted(scores["engine"].unique()), horizontal=True,
+        format_func=lambda name: ENGINE_LABELS.get(name, name),
+    )
+    probability = engine not in ("rules", audit_log.OVERRIDE_ENGINE)
+    selected = scores[scores["engine"] == engine]
+    if probability:
+        selected = selected.assign(bucket=selected["bucket"] / audit_log.PROBABILITY_BUCKETS)
+    st.plotly_chart(
+        px.bar(selected, x="bucket", y="count", color="condition", barmode="group",
+               labels={"bucket": "Вероятность (от)" if probability else "Баллы",
+                       "count": "Обращений", "condition": "Состояние"}),
+        use_container_width=True,
+    )
+
+
+main()
@@ -0,0 +1,198 @@
+"""
+Многопроцессная диагностика больших когорт
+
+Битовые маски находок и показатели один раз кладутся в разделяемую
+память; процессы пула оценивают свои диапазоны строк и пишут баллы и
+ранжирование в общие выходные массивы, поэтому порядок строк сохраняется.
+
+Пример замера масштабирования:
+    python parallel_scoring.py --patients 2000000 --max-workers 8
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from diagnosis import BatchDiagnosis, score_bitsets
+from knowledge_base import get_knowledge_base
+from vocabulary import FINDING_IDS, encode_patients
+
+# Строк в одной задаче пула; мелкие задачи выравнивают нагрузку между процессами
+DEFAULT_SHARD_SIZE = 100_000
+
+# Массивы, подключенные в процессе пула (заполняется инициализатором)
+_WORKER_ARRAYS = {}
+_WORKER_SEGMENTS = []
+_WORKER_STATE = {}
+
+
+def _share(array):
+    """
+    Копирует массив в новый сегмент разделяемой памяти; возвращает сегмент и описание для процессов
+    """
+    array = np.ascontiguousarray(array)
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+    return segment, (segment.name, array.shape, array.dtype.str)
+
+
+def _allocate(shape, dtype):
+    dtype = np.dtype(dtype)
+    segment = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+    return segment, (segment.name, shape, dtype.str)
+
+
+def _attach(spec):
+    name, shape, dtype = spec
+    # Процессы пула используют трекер ресурсов родителя, сегмент удаляет только родитель
+    segment = shared_memory.SharedMemory(name=name)
+    return segment, np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+
+
+def _init_worker(specs, kb):
+    _WORKER_STATE["kb"] = kb
+    for key, spec in specs.items():
+        segment, array = _attach(spec)
+        _WORKER_SEGMENTS.append(segment)
+        _WORKER_ARRAYS[key] = array
+
+
+def _score_shard(start, stop):
+    a = _WORKER_ARRAYS
+    result = score_bitsets(
+        a["findings"][start:stop],
+        a["temperature"][start:stop], a["bp_systolic"][start:stop], a["bp_diastolic"][start:stop],
+        a["wbc"][start:stop], a["crp"][start:stop],
+        _WORKER_STATE["kb"],
+    )
+    a["scores"][start:stop] = result.scores
+    a["ranking"][start:stop] = result.ranking
+    a["crisis"][start:stop] = result.crisis
+    return stop - start
+
+
+def score_bitsets_parallel(bitsets, temperature, bp_systolic, bp_diastolic, wbc, crp, kb=None,
+                           workers=None, shard_size=DEFAULT_SHARD_SIZE, force_pool=False):
+    """
+    Аналог score_bitsets, распределяющий строки по пулу процессов; при одном процессе или
+    одной части оценивает в текущем процессе, если не задан force_pool (замеры, проверки)
+    """
+    kb = kb if kb is not None else get_knowledge_base()
+    workers = workers or os.cpu_count() or 1
+    n = len(bitsets)
+    if not force_pool and (workers == 1 or n <= shard_size):
+        return score_bitsets(bitsets, temperature, bp_systolic, bp_diastolic, wbc, crp, kb)
+
+    inputs = {
+        "findings": np.asarray(bitsets, dtype=np.uint64),
+        "temperature": np.asarray(temperature, dtype=np.float64),
+        "bp_systolic": np.asarray(bp_systolic, dtype=np.float64),
+        "bp_diastolic": np.asarray(bp_diastolic, dtype=np.float64),
+        "wbc": np.asarray(wbc, dtype=np.float64),
+        "crp": np.asarray(crp, dtype=np.float64),
+    }
+    outputs = {
+        "scores": ((n, len(kb)), np.int16),
+        "ranking": ((n, len(kb)), np.int64),
+        "crisis": ((n,), bool),
+    }
+
+    segments, specs = [], {}
+    try:
+        for key, array in inputs.items():
+            segment, specs[key] = _share(array)
+            segments.append(segment)
+        for key, (shape, dtype) in outputs.items():
+            segment, specs[key] = _allocate(shape, dtype)
+            segments.append(segment)
+
+        bounds = [(start, min(start + shard_size, n)) for start in range(0, n, shard_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(specs, kb)) as pool:
+            for _ in pool.map(_score_shard, *zip(*bounds)):
+                pass
+
+        views = {
+            key: np.ndarray(specs[key][1], dtype=specs[key][2], buffer=segment.buf)
+            for key, segment in zip(specs, segments)
+        }
+        return BatchDiagnosis(
+            scores=views["scores"].copy(),
+            ranking=views["ranking"].copy(),
+            crisis=views["crisis"].copy(),
+            conditions=kb.condition_names,
+            override_column=kb.override_column,
+            override_score=kb.override_score,
+        )
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+
+def medical_diagnosis_parallel(symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, kb=None,
+                               workers=None, shard_size=DEFAULT_SHARD_SIZE, force_pool=False):
+    """
+    Многопроцессная диагностика когорты; результаты в порядке входных строк
+    """
+    return score_bitsets_parallel(
+        encode_patients(symptoms, lab_data),
+        temperature, bp_systolic, bp_diastolic, wbc, crp, kb,
+        workers=workers, shard_size=shard_size, force_pool=force_pool,
+    )
+
+
+def _random_cohort(n, seed=0):
+    rng = np.random.default_rng(seed)
+    bitsets = np.zeros(n, dtype=np.uint64)
+    for bit in FINDING_IDS.values():
+        bitsets |= (rng.random(n) < 0.12).astype(np.uint64) << np.uint64(bit)
+    return (
+        bitsets,
+        np.round(rng.uniform(35.5, 41.0, n), 1),
+        rng.integers(90, 230, n).astype(np.float64),
+        rng.integers(55, 145, n).astype(np.float64),
+        np.round(rng.uniform(2.0, 20.0, n), 1),
+        np.round(rng.uniform(0.0, 30.0, n), 1),
+    )
+
+
+def benchmark_scaling(patients=1_000_000, max_workers=None, shard_size=DEFAULT_SHARD_SIZE, seed=0):
+    """
+    Замеряет пропускную способность пула при числе процессов от 1 до max_workers;
+    ускорение считается относительно пула из одного процесса, оценка в текущем
+    процессе (без пула и разделяемой памяти) выводится отдельной строкой
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    cohort = _random_cohort(patients, seed)
+    started = time.perf_counter()
+    reference = score_bitsets(*cohort)
+    serial = time.perf_counter() - started
+
+    rows = []
+    for workers in range(1, max_workers + 1):
+        started = time.perf_counter()
+        result = score_bitsets_parallel(*cohort, workers=workers, shard_size=shard_size, force_pool=True)
+        elapsed = time.perf_counter() - started
+        assert np.array_equal(result.scores, reference.scores)
+        assert np.array_equal(result.ranking, reference.ranking)
+        rows.append((workers, elapsed, patients / elapsed))
+
+    baseline = rows[0][1]
+    print(f"{'процессы':>8} {'время, с':>10} {'пациентов/с':>14} {'ускорение':>10}")
+    print(f"{'без пула':>8} {serial:>10.3f} {patients / serial:>14,.0f} {baseline / serial:>10.2f}")
+    for workers, elapsed, rate in rows:
+        print(f"{workers:>8} {elapsed:>10.3f} {rate:>14,.0f} {baseline / elapsed:>10.2f}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замер масштабирования многопроцессной диагностики")
+    parser.add_argument("--patients", type=int, default=1_000_000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    benchmark_scaling(args.patients, args.max_workers, args.shard_size, args.seed)
@@ -0,0 +1,414 @@
+"""
+Вероятностная оценка: наивный байесовский классификатор по признакам обращения
+
+Признаки - те же биты, что у правил (находки и производные признаки из
+vocabulary.py). Обучение за один потоковый проход накапливает достаточные
+статистики (число обращений по состояниям и число каждого признака внутри
+состояния), поэтому память не зависит от объема данных. Веса - логарифмы
+отношений правдоподобия и априорные вероятности, инференс - одно
+умножение матрицы весов на вектор признаков (матрица на матрицу для пакета).
+Вероятности калибруются температурой на отложенной части данных.
+
+Гипертонический криз по-прежнему определяется приоритетным правилом базы
+знаний (АД не входит в признаки), модель ранжирует остальные состояния.
+
+    python probabilistic_scoring.py train encounters.csv --label-column diagnosis
+    python probabilistic_scoring.py train --synthetic 1000000
+    python probabilistic_scoring.py evaluate encounters.csv --label-column diagnosis
+
+Обученная модель сохраняется в DIAGNOSIS_MODEL (по умолчанию diagnosis_model.npz).
+"""
+import argparse
+import hashlib
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+from diagnosis import BatchDiagnosis, add_derived_features, derived_feature_bits, override_mask
+from knowledge_base import get_knowledge_base
+from vocabulary import BITSET_WIDTH, encode_patient, encode_patients
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL_PATH = os.environ.get("DIAGNOSIS_MODEL", os.path.join(ROOT, "diagnosis_model.npz"))
+DEFAULT_ALPHA = 1.0
+DEFAULT_HOLDOUT = 0.05
+DEFAULT_HOLDOUT_LIMIT = 200_000
+CALIBRATION_BINS = 10
+
+
+class ModelMismatchError(ValueError):
+    pass
+
+
+def feature_matrix(feature_bitsets):
+    """
+    Биты признаков в виде матрицы N × BITSET_WIDTH из 0 и 1
+    """
+    bitsets = np.ascontiguousarray(feature_bitsets, dtype="<u8").reshape(-1)
+    return np.unpackbits(bitsets.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    weights = np.exp(logits)
+    return weights / weights.sum(axis=-1, keepdims=True)
+
+
+class SufficientStatistics:
+    """
+    Счетчики для обучения: обращения по состояниям и признаки внутри состояний; части можно объединять
+    """
+
+    def __init__(self, conditions):
+        self.conditions = tuple(conditions)
+        self.class_counts = np.zeros(len(self.conditions), dtype=np.int64)
+        self.feature_counts = np.zeros((len(self.conditions), BITSET_WIDTH), dtype=np.int64)
+
+    @property
+    def total(self):
+        return int(self.class_counts.sum())
+
+    def update(self, feature_bitsets, labels):
+        """
+        Добавляет часть обращений; labels - номера состояний в self.conditions
+        """
+        labels = np.asarray(labels, dtype=np.intp)
+        if not len(labels):
+            return
+        self.class_counts += np.bincount(labels, minlength=len(self.conditions))
+        # Сортировка по состоянию и сумма по отрезкам вместо поэлементного np.add.at
+        order = np.argsort(labels, kind="stable")
+        features = feature_matrix(feature_bitsets)[order]
+        starts = np.flatnonzero(np.r_[True, np.diff(labels[order]) != 0])
+        self.feature_counts[labels[order][starts]] += np.add.reduceat(features, starts, axis=0, dtype=np.int64)
+
+    def merge(self, other):
+        if other.conditions != self.conditions:
+            raise ModelMismatchError("Статистики собраны для разных наборов состояний")
+        self.class_counts += other.class_counts
+        self.feature_counts += other.feature_counts
+        return self
+
+
+class ProbabilisticModel:
+    """
+    Наивный байесовский классификатор: log P(состояние | признаки) = W @ x + b с калибровкой температурой
+    """
+
+    name = "bayes"
+
+    def __init__(self, conditions, weights, bias, temperature=1.0, knowledge_base_version="", trained_on=0):
+        self.conditions = tuple(conditions)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.bias = np.asarray(bias, dtype=np.float64)
+        self.temperature = float(temperature)
+        self.knowledge_base_version = knowledge_base_version
+        self.trained_on = int(trained_on)
+        self._update_cache_key()
+
+    def _update_cache_key(self):
+        self.cache_key = hashlib.sha256(
+            self.weights.tobytes() + self.bias.tobytes() + repr(self.temperature).encode()
+        ).hexdigest()[:16]
+
+    @classmethod
+    def fit(cls, stats, alpha=DEFAULT_ALPHA, knowledge_base_version=""):
+        """
+        Веса по достаточным статистикам со сглаживанием Лапласа alpha
+        """
+        counts = stats.class_counts.astype(np.float64)
+        present = (stats.feature_counts + alpha) / (counts[:, None] + 2 * alpha)
+        log_present, log_absent = np.log(present), np.log1p(-present)
+        prior = np.log((counts + alpha) / (counts.sum() + alpha * len(counts)))
+        return cls(
+            stats.conditions,
+            weights=log_present - log_absent,
+            bias=prior + log_absent.sum(axis=1),
+            knowledge_base_version=knowledge_base_version,
+            trained_on=stats.total,
+        )
+
+    def logits(self, feature_bitsets):
+        return feature_matrix(feature_bitsets) @ self.weights.T + self.bias
+
+    def predict_proba(self, feature_bitsets):
+        """
+        Калиброванные вероятности N × len(conditions) по маскам с производными признаками
+        """
+        return _softmax(self.logits(feature_bitsets) / self.temperature)
+
+    def probabilities(self, feature_bits):
+        """
+        Вероятности для одного пациента: одно умножение матрицы весов на вектор признаков
+        """
+        x = feature_matrix(np.array([feature_bits], dtype=np.uint64))[0]
+        return _softmax((self.weights @ x + self.bias) / self.temperature)
+
+    def calibrate(self, feature_bitsets, labels, low=0.05, high=20.0, iterations=60):
+        """
+        Подбирает температуру, минимизирующую логарифмическую потерю на отложенных данных
+        """
+        logits = self.logits(feature_bitsets)
+        labels = np.asarray(labels, dtype=np.intp)
+
+        def loss(log_temperature):
+            scaled = logits / np.exp(log_temperature)
+            scaled -= scaled.max(axis=1, keepdims=True)
+            return float(np.mean(np.log(np.exp(scaled).sum(axis=1)) - scaled[np.arange(len(labels)), labels]))
+
+        # Золотое сечение по логарифму температуры (потеря выпукла по 1/T)
+        a, b = np.log(low), np.log(high)
+        ratio = (np.sqrt(5) - 1) / 2
+        c, d = b - ratio * (b - a), a + ratio * (b - a)
+        for _ in range(iterations):
+            if loss(c) < loss(d):
+                b, d = d, c
+                c = b - ratio * (b - a)
+            else:
+                a, c = c, d
+                d = a + ratio * (b - a)
+        self.temperature = float(np.exp((a + b) / 2))
+        self._update_cache_key()
+        return self.temperature
+
+    def check(self, kb):
+        """
+        Модель обучена для тех же состояний, что ранжирует база знаний
+        """
+        expected = tuple(kb.condition_names[col] for col in kb.ranked_columns)
+        if self.conditions != expected:
+            raise ModelMismatchError(
+                f"Модель обучена для базы знаний {self.knowledge_base_version or '?'} с другим набором состояний"
+            )
+
+    def diagnose(self, symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, kb=None, top=None):
+        """
+        Диагностика одного пациента в формате diagnosis.diagnose; вместо баллов - вероятности
+        """
+        kb = kb if kb is not None else get_knowledge_base()
+        bits = encode_patient(symptoms, lab_data)
+        if kb.is_override(bits, bp_systolic, bp_diastolic):
+            return kb.override_condition, kb.override_score
+        probabilities = self.probabilities(derived_feature_bits(bits, temperature, wbc, crp, kb.thresholds))
+        order = np.argsort(-probabilities, kind="stable")[:top]
+        ranked = [(self.conditions[i], float(probabilities[i])) for i in order]
+        return ranked[0][0], ranked
+
+    def score_bitsets(self, bitsets, temperature, bp_systolic, bp_diastolic, wbc, crp, kb=None):
+        """
+        Пакетная оценка в формате diagnosis.score_bitsets; scores содержит вероятности,
+        у пациентов с приоритетным правилом вероятность его состояния равна 1
+        """
+        kb = kb if kb is not None else get_knowledge_base()
+        self.check(kb)
+        bitsets = np.asarray(bitsets, dtype=np.uint64)
+        probabilities = self.predict_proba(add_derived_features(bitsets, temperature, wbc, crp, kb.thresholds))
+        crisis = override_mask(bitsets, bp_systolic, bp_diastolic, kb)
+
+        scores = np.zeros((len(bitsets), len(kb.condition_names)), dtype=np.float64)
+        scores[:, kb.ranked_columns] = probabilities
+        sort_key = scores.copy()
+        column = kb.override_column
+        if column is not None:
+            sort_key[:, column] = np.where(crisis, np.inf, -np.inf)
+            scores[crisis, column] = 1.0
+        return BatchDiagnosis(
+            scores=scores, ranking=np.argsort(-sort_key, axis=1, kind="stable"), crisis=crisis,
+            conditions=kb.condition_names, override_column=column, override_score=kb.override_score,
+        )
+
+    def save(self, path=DEFAULT_MODEL_PATH):
+        with open(path, "wb") as f:
+            np.savez(
+                f, conditions=np.array(self.conditions), weights=self.weights, bias=self.bias,
+                temperature=self.temperature, knowledge_base_version=self.knowledge_base_version,
+                trained_on=self.trained_on,
+            )
+
+    @classmethod
+    def load(cls, path=DEFAULT_MODEL_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                [str(name) for name in data["conditions"]], data["weights"], data["bias"],
+                float(data["temperature"]), str(data["knowledge_base_version"]), int(data["trained_on"]),
+            )
+
+
+def load_model(path=DEFAULT_MODEL_PATH, kb=None):
+    """
+    Обученная модель, совместимая с текущей базой знаний, или None (файла нет или состояния не совпадают)
+    """
+    if not os.path.exists(path):
+        return None
+    model = ProbabilisticModel.load(path)
+    try:
+        model.check(kb if kb is not None else get_knowledge_base())
+    except ModelMismatchError as e:
+        warnings.warn(f"{path}: {e}")
+        return None
+    # Загруженная модель разделяется сессиями и не должна изменяться
+    model.weights.flags.writeable = model.bias.flags.writeable = False
+    return model
+
+
+# ОБУЧЕНИЕ
+def iter_labeled_file(path, label_column="diagnosis", chunksize=100_000, delimiter=";", kb=None):
+    """
+    Части размеченного файла (CSV/Parquet в формате triage_cli): (маски признаков, названия состояний)
+    """
+    from triage_cli import iter_chunks, parse_chunk
+
+    kb = kb if kb is not None else get_knowledge_base()
+    for chunk in iter_chunks(path, chunksize):
+        bitsets, vitals = parse_chunk(chunk, delimiter)
+        features = add_derived_features(bitsets, vitals["temperature"], vitals["wbc"], vitals["crp"], kb.thresholds)
+        yield features, chunk[label_column].astype(str).to_numpy()
+
+
+def iter_synthetic(patients, chunksize=100_000, seed=0, kb=None):
+    """
+    Части синтетических обращений из генератора benchmarks.synthetic_cohort
+    """
+    from benchmarks import synthetic_cohort
+
+    kb = kb if kb is not None else get_knowledge_base()
+    for number, start in enumerate(range(0, patients, chunksize)):
+        cohort = synthetic_cohort(min(chunksize, patients - start), seed + number, kb)
+        features = add_derived_features(
+            encode_patients(cohort.symptoms, cohort.lab_data), cohort.temperature, cohort.wbc, cohort.crp, kb.thresholds
+        )
+        yield features, np.array(cohort.source)
+
+
+def _label_indices(names, conditions):
+    lookup = {name: i for i, name in enumerate(conditions)}
+    labels = np.fromiter((lookup.get(name, -1) for name in names), dtype=np.intp, count=len(names))
+    return labels, labels >= 0
+
+
+def train(chunks, kb=None, alpha=DEFAULT_ALPHA, holdout=DEFAULT_HOLDOUT, holdout_limit=DEFAULT_HOLDOUT_LIMIT,
+          seed=0, progress=True):
+    """
+    Обучение за один проход по частям (маски признаков, названия состояний).
+    Доля holdout обращений (не больше holdout_limit) откладывается для калибровки.
+    """
+    kb = kb if kb is not None else get_knowledge_base()
+    conditions = tuple(kb.condition_names[col] for col in kb.ranked_columns)
+    stats = SufficientStatistics(conditions)
+    rng = np.random.default_rng(seed)
+    held_features, held_labels = [], []
+    held = skipped = 0
+    started = time.perf_counter()
+
+    for features, names in chunks:
+        labels, known = _label_indices(names, conditions)
+        skipped += int((~known).sum())
+        features, labels = np.asarray(features, dtype=np.uint64)[known], labels[known]
+        to_holdout = np.zeros(len(labels), dtype=bool)
+        if held < holdout_limit:
+            take = np.flatnonzero(rng.random(len(labels)) < holdout)[:holdout_limit - held]
+            to_holdout[take] = True
+            held_features.append(features[take])
+            held_labels.append(labels[take])
+            held += len(take)
+        stats.update(features[~to_holdout], labels[~to_holdout])
+        if progress:
+            print(f"\r{stats.total + held:,} обращений | {time.perf_counter() - started:.1f} с",
+                  end="", file=sys.stderr, flush=True)
+
+    if stats.total == 0:
+        raise ValueError("Нет размеченных обращений с состояниями из базы знаний")
+    model = ProbabilisticModel.fit(stats, alpha, kb.version)
+    if held:
+        model.calibrate(np.concatenate(held_features), np.concatenate(held_labels))
+    if progress:
+        print(f"\nОбучено на {stats.total:,} обращениях, калибровка на {held:,}, пропущено {skipped:,} "
+              f"(неизвестные состояния или приоритетное правило), температура {model.temperature:.3f}",
+              file=sys.stderr)
+    return model
+
+
+def evaluate(model, chunks):
+    """
+    Точность, логарифмическая потеря, оценка Брайера и ошибка калибровки (ECE) по частям размеченных данных
+    """
+    total = correct = 0
+    log_loss = brier = 0.0
+    bin_count = np.zeros(CALIBRATION_BINS)
+    bin_confidence = np.zeros(CALIBRATION_BINS)
+    bin_correct = np.zeros(CALIBRATION_BINS)
+
+    for features, names in chunks:
+        labels, known = _label_indices(names, model.conditions)
+        if not known.any():
+            continue
+        labels = labels[known]
+        probabilities = model.predict_proba(np.asarray(features, dtype=np.uint64)[known])
+        rows = np.arange(len(labels))
+        predicted = probabilities.argmax(axis=1)
+        confidence = probabilities[rows, predicted]
+        hit = predicted == labels
+
+        total += len(labels)
+        correct += int(hit.sum())
+        log_loss -= float(np.log(np.clip(probabilities[rows, labels], 1e-15, None)).sum())
+        target = np.zeros_like(probabilities)
+        target[rows, labels] = 1.0
+        brier += float(((probabilities - target) ** 2).sum())
+        bins = np.minimum((confidence * CALIBRATION_BINS).astype(int), CALIBRATION_BINS - 1)
+        bin_count += np.bincount(bins, minlength=CALIBRATION_BINS)
+        bin_confidence += np.bincount(bins, weights=confidence, minlength=CALIBRATION_BINS)
+        bin_correct += np.bincount(bins, weights=hit, minlength=CALIBRATION_BINS)
+
+    if not total:
+        raise ValueError("Нет размеченных обращений с состояниями модели")
+    return {
+        "records": total,
+        "accuracy": correct / total,
+        "log_loss": log_loss / total,
+        "brier": brier / total,
+        "ece": float(np.abs(bin_confidence - bin_correct).sum() / total),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обучение и проверка вероятностной модели диагностики")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("train", "evaluate"):
+        command = sub.add_parser(name)
+        command.add_argument("input", nargs="?", help="Размеченные обращения (.csv или .parquet)")
+        command.add_argument("--label-column", default="diagnosis")
+        command.add_argument("--delimiter", default=";", help="Разделитель симптомов и анализов внутри ячейки")
+        command.add_argument("--chunksize", type=int, default=100_000)
+        command.add_argument("--synthetic", type=int, help="Синтетические обращения вместо файла")
+        command.add_argument("--seed", type=int, default=0)
+        command.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    sub.choices["train"].add_argument("--alpha", type=float, default=DEFAULT_ALPHA, help="Сглаживание Лапласа")
+    sub.choices["train"].add_argument("--holdout", type=float, default=DEFAULT_HOLDOUT,
+                                      help="Доля обращений для калибровки")
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        # Для проверки берется другой seed, чтобы не оценивать модель на обучающих данных
+        seed = args.seed if args.command == "train" else args.seed + 1_000_003
+        chunks = iter_synthetic(args.synthetic, args.chunksize, seed)
+    elif args.input:
+        chunks = iter_labeled_file(args.input, args.label_column, args.chunksize, args.delimiter)
+    else:
+        parser.error("укажите файл обращений или --synthetic")
+
+    if args.command == "train":
+        model = train(chunks, alpha=args.alpha, holdout=args.holdout, seed=args.seed)
+        model.save(args.model)
+        print(f"Модель сохранена: {args.model}")
+    else:
+        metrics = evaluate(ProbabilisticModel.load(args.model), chunks)
+        for name, value in metrics.items():
+            print(f"{name:>10}: {value:,.4f}" if isinstance(value, float) else f"{name:>10}: {value:,}")
+
+
+if __name__ == "__main__":
+    main()
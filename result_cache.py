@@ -0,0 +1,165 @@
+"""
+Кэш результатов диагностики по каноническому виду входных данных
+
+Правила видят показатели только через пороги, поэтому ключ составляется из
+маски находок и флагов "выше/ниже порога" (температура 38 и диапазон 37-38,
+лейкоциты 10, СРБ 5, АД 180/120) - два пациента с одинаковым ключом всегда
+получают одинаковый результат. Ключ включает контрольную сумму базы знаний, а
+при ее смене кэш очищается.
+"""
+import collections
+import threading
+import time
+from dataclasses import dataclass
+
+from diagnosis import diagnose
+from instrumentation import stage
+from knowledge_base import get_knowledge_base
+from vocabulary import encode_patient
+
+DEFAULT_MAXSIZE = 4096
+DEFAULT_TTL_SECONDS = 3600
+
+
+def canonical_key(symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, thresholds):
+    """
+    Канонический ключ входных данных: порядок и повторы симптомов, а также
+    значения показателей внутри одного порогового интервала на него не влияют
+    """
+    fever = thresholds["fever_temperature"]
+    return (
+        encode_patient(symptoms, lab_data),
+        temperature > fever,
+        thresholds["subfebrile_temperature"] < temperature < fever,
+        wbc > thresholds["wbc"],
+        crp > thresholds["crp"],
+        bp_systolic > thresholds["bp_systolic"],
+        bp_diastolic > thresholds["bp_diastolic"],
+    )
+
+
+@dataclass(frozen=True)
+class CachedDiagnosis:
+    """
+    Результат диагностики с подготовленным текстом плана лечения; общий для всех сессий, не изменяется
+    """
+    main_diagnosis: str
+    all_diagnoses: object
+    info: dict
+    treatment_markdown: str
+    knowledge_base_version: str
+    engine: str = "rules"
+
+    @property
+    def override(self):
+        # При приоритетном правиле вместо списка состояний хранится число баллов
+        return not isinstance(self.all_diagnoses, tuple)
+
+    @property
+    def score(self):
+        return self.all_diagnoses if self.override else self.all_diagnoses[0][1]
+
+    @property
+    def differential(self):
+        return () if self.override else self.all_diagnoses[1:]
+
+
+class ResultCache:
+    """
+    Потокобезопасный LRU-кэш с ограничением времени жизни записей и счетчиками попаданий
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL_SECONDS, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._checksum = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _check_knowledge_base(self, kb):
+        # Вызывается под блокировкой: при смене базы знаний старые результаты недействительны
+        if kb.checksum != self._checksum:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._checksum = kb.checksum
+
+    def get(self, key, kb):
+        with self._lock:
+            self._check_knowledge_base(kb)
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value, kb):
+        with self._lock:
+            self._check_knowledge_base(kb)
+            self._entries[key] = (value, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def diagnose(self, symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, kb=None, engine=None):
+        """
+        Диагностика с планом лечения; повторные обращения с тем же каноническим ключом берутся из кэша.
+        engine - вероятностная модель (probabilistic_scoring) вместо правил.
+        """
+        kb = kb if kb is not None else get_knowledge_base()
+        key = canonical_key(symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, kb.thresholds)
+        if engine is not None:
+            key += (engine.cache_key,)
+        with stage("cache_lookup"):
+            cached = self.get(key, kb)
+        if cached is not None:
+            return cached
+
+        main_diagnosis, all_diagnoses = (engine.diagnose if engine is not None else diagnose)(
+            symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, kb=kb
+        )
+        info = kb[main_diagnosis]
+        result = CachedDiagnosis(
+            main_diagnosis=main_diagnosis,
+            all_diagnoses=tuple(all_diagnoses) if isinstance(all_diagnoses, list) else all_diagnoses,
+            info=info,
+            treatment_markdown=kb.treatment_markdown[main_diagnosis],
+            knowledge_base_version=kb.version,
+            engine=engine.name if engine is not None else "rules",
+        )
+        self.put(key, result, kb)
+        return result
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
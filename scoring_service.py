@@ -0,0 +1,411 @@
+"""
+JSON-сервис диагностики для интеграции с МИС (только стандартная библиотека и NumPy)
+
+Одновременные запросы собираются в пакеты в пределах окна ожидания и
+оцениваются одним векторизованным вызовом medical_diagnosis_batch. Очередь
+ограничена: при переполнении сервис сразу отвечает 503.
+
+    POST /diagnose  {"symptoms": [...], "lab_data": [...], "temperature": 38.5,
+                     "bp_systolic": 120, "bp_diastolic": 80, "wbc": 12.0, "crp": 8.0}
+    GET  /health
+    GET  /stats     задержки p50/p99, пропускная способность, размер пакетов
+    GET  /metrics   метрики в формате Prometheus (таймеры этапов при DIAGNOSIS_METRICS=1)
+
+Запуск сервиса и нагрузочного теста:
+    python scoring_service.py serve --port 8080 --max-wait-ms 2
+    python scoring_service.py loadgen --port 8080 --concurrency 64 --requests 20000
+"""
+import argparse
+import asyncio
+import collections
+import json
+import math
+import time
+import warnings
+
+import numpy as np
+
+import instrumentation
+from diagnosis import DEFAULT_VITALS, medical_diagnosis_batch
+from knowledge_base import get_knowledge_base
+
+DEFAULT_MAX_BATCH = 256
+DEFAULT_MAX_WAIT_MS = 2.0
+DEFAULT_QUEUE_SIZE = 4096
+MAX_BODY_BYTES = 64 * 1024
+
+_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Overloaded(Exception):
+    pass
+
+
+def parse_patient(payload):
+    """
+    Проверяет тело запроса и возвращает кортеж входных данных пациента
+    """
+    if not isinstance(payload, dict):
+        raise RequestError(400, "Ожидается JSON-объект")
+    symptoms = payload.get("symptoms", [])
+    lab_data = payload.get("lab_data", [])
+    if not isinstance(symptoms, list) or not isinstance(lab_data, list):
+        raise RequestError(400, "symptoms и lab_data должны быть списками")
+    if not all(isinstance(item, str) for item in symptoms + lab_data):
+        raise RequestError(400, "symptoms и lab_data должны быть списками строк")
+    vitals = []
+    for name, default in DEFAULT_VITALS.items():
+        value = payload.get(name, default)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise RequestError(400, f"{name} должно быть числом")
+        # json.loads принимает NaN и Infinity; такие показатели молча проходили бы все пороги мимо
+        if not math.isfinite(value):
+            raise RequestError(400, f"{name} должно быть конечным числом")
+        vitals.append(value)
+    return (symptoms, lab_data, *vitals)
+
+
+class LatencyStats:
+    """
+    Скользящее окно задержек и счетчики пропускной способности
+    """
+
+    def __init__(self, window=10_000):
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.started = time.perf_counter()
+        self.completed = 0
+        self.rejected = 0
+
+    def snapshot(self):
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        elapsed = time.perf_counter() - self.started
+        return {
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "throughput_rps": round(self.completed / elapsed, 1) if elapsed else 0.0,
+            "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+            "latency_ms_p99": round(float(np.percentile(latencies, 99)), 3),
+            "mean_batch_size": round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else 0.0,
+        }
+
+
+class MicroBatcher:
+    """
+    Собирает запросы из ограниченной очереди в пакеты размером до max_batch,
+    ожидая не дольше max_wait_ms после первого запроса пакета
+    """
+
+    def __init__(self, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS, queue_size=DEFAULT_QUEUE_SIZE):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.stats = LatencyStats()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, patient):
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((patient, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.stats.rejected += 1
+            raise Overloaded() from None
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    @staticmethod
+    def _score(batch, kb):
+        """
+        (результат пакета, строка) для каждого запроса; если пакет не оценивается целиком,
+        запросы оцениваются по одному, и ошибка достается только вызвавшему ее запросу
+        """
+        try:
+            columns = list(zip(*(patient for patient, _, _ in batch)))
+            result = medical_diagnosis_batch(*columns, kb=kb)
+            return [(result, i) for i in range(len(batch))]
+        except Exception:
+            scored = []
+            for patient, _, _ in batch:
+                try:
+                    scored.append((medical_diagnosis_batch(*([value] for value in patient), kb=kb), 0))
+                except Exception as e:
+                    scored.append((e, None))
+            return scored
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                self._deliver(batch)
+            except Exception as e:  # сбой одного пакета не должен останавливать обработку очереди
+                warnings.warn(f"Пакет из {len(batch)} запросов не обработан: {e!r}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _deliver(self, batch):
+        """
+        Оценивает пакет и передает результаты ожидающим запросам
+        """
+        kb = get_knowledge_base()
+        scored = self._score(batch, kb)
+
+        now = time.perf_counter()
+        self.stats.batch_sizes.append(len(batch))
+        for (_, future, enqueued), (result, i) in zip(batch, scored):
+            if future.done():
+                continue
+            if i is None:
+                future.set_exception(result)
+                continue
+            main, detail = result.result(i)
+            override = bool(result.crisis[i])
+            future.set_result({
+                "main_diagnosis": main,
+                "score": detail if override else detail[0][1],
+                "override": override,
+                "differential": [] if override else [
+                    {"condition": condition, "score": score} for condition, score in detail[1:]
+                ],
+                "source": kb[main].get("source"),
+                "knowledge_base_version": kb.version,
+            })
+            self.stats.latencies.append(now - enqueued)
+            self.stats.completed += 1
+
+
+async def _read_request(reader):
+    """
+    Читает один HTTP/1.1 запрос; возвращает (метод, путь, заголовки, тело) или None при закрытии соединения
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, path, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise RequestError(400, "Некорректная строка запроса") from None
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0) or 0)
+    except ValueError:
+        raise RequestError(400, "Некорректный Content-Length") from None
+    if length < 0:
+        raise RequestError(400, "Некорректный Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise RequestError(413, "Слишком большое тело запроса")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+def _response(status, payload, keep_alive=True):
+    if isinstance(payload, str):
+        body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+    else:
+        body, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8"
+    head = (
+        f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+    )
+    if status == 503:
+        head += "Retry-After: 1\r\n"
+    return head.encode("latin-1") + b"\r\n" + body
+
+
+class ScoringService:
+    def __init__(self, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS, queue_size=DEFAULT_QUEUE_SIZE):
+        self.batcher = MicroBatcher(max_batch, max_wait_ms, queue_size)
+        instrumentation.register_collector("service", self.batcher.stats.snapshot)
+
+    async def handle(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok", "knowledge_base_version": get_knowledge_base().version}
+        if method == "GET" and path == "/stats":
+            return 200, {**self.batcher.stats.snapshot(), "queue_depth": self.batcher.queue.qsize()}
+        if method == "GET" and path == "/metrics":
+            return 200, instrumentation.render_prometheus()
+        if method == "POST" and path == "/diagnose":
+            try:
+                payload = json.loads(body)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                raise RequestError(400, "Некорректный JSON") from None
+            try:
+                return 200, await self.batcher.submit(parse_patient(payload))
+            except Overloaded:
+                return 503, {"error": "Очередь переполнена, повторите запрос позже"}
+        return 404, {"error": "Не найдено"}
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    status, payload = await self.handle(method, path, body)
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                except RequestError as e:
+                    status, payload, keep_alive = e.status, {"error": str(e)}, False
+                except Exception as e:  # ошибка одного запроса не должна обрывать соединение без ответа
+                    warnings.warn(f"Сервис диагностики: ошибка обработки запроса: {e!r}")
+                    status, payload, keep_alive = 500, {"error": "Внутренняя ошибка сервиса"}, False
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        self.batcher.start()
+        server = await asyncio.start_server(self._serve_connection, host, port, backlog=1024)
+        print(f"Сервис диагностики: http://{host}:{port} (пакет до {self.batcher.max_batch}, "
+              f"окно {self.batcher.max_wait * 1000:g} мс)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+
+
+# НАГРУЗОЧНЫЙ ТЕСТ
+
+_SAMPLE_PATIENTS = [
+    {"symptoms": ["Лихорадка >38°C", "Кашель", "Одышка"], "temperature": 38.7, "wbc": 12.5, "crp": 24.0},
+    {"symptoms": ["Боль в горле", "Налеты на миндалинах", "Лихорадка >38°C"], "temperature": 38.4},
+    {"symptoms": ["Дизурия", "Учащенное мочеиспускание"], "lab_data": ["Лейкоциты в моче"]},
+    {"symptoms": ["Головная боль", "Тошнота"], "bp_systolic": 200, "bp_diastolic": 125},
+    {"symptoms": ["Чихание", "Ринорея", "Зуд в носу", "Сезонность"]},
+    {"symptoms": ["Пульсирующая головная боль", "Аура", "Фоно/фотофобия"]},
+]
+
+
+async def _client(host, port, requests, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for i in range(requests):
+            body = json.dumps(_SAMPLE_PATIENTS[i % len(_SAMPLE_PATIENTS)], ensure_ascii=False).encode("utf-8")
+            started = time.perf_counter()
+            writer.write(
+                f"POST /diagnose HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            status = int(head.split(b" ", 2)[1])
+            length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+    finally:
+        writer.close()
+
+
+async def run_load(host="127.0.0.1", port=8080, concurrency=64, requests=20_000):
+    """
+    Нагрузочный тест: concurrency клиентов с постоянными соединениями отправляют запросы
+    """
+    latencies, statuses = [], collections.Counter()
+    per_client = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    started = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, n, latencies, statuses) for n in per_client if n))
+    elapsed = time.perf_counter() - started
+
+    ms = np.array(latencies) * 1000
+    report = {
+        "requests": len(latencies),
+        "statuses": dict(statuses),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_ms_p50": round(float(np.percentile(ms, 50)), 3),
+        "latency_ms_p99": round(float(np.percentile(ms, 99)), 3),
+    }
+    return report
+
+
+async def _self_test(args):
+    service = ScoringService(args.max_batch, args.max_wait_ms, args.queue_size)
+    server_task = asyncio.create_task(service.serve(args.host, args.port))
+    await asyncio.sleep(0.2)
+    try:
+        report = await run_load(args.host, args.port, args.concurrency, args.requests)
+        report["server"] = service.batcher.stats.snapshot()
+        return report
+    finally:
+        server_task.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON-сервис диагностики с пакетной обработкой запросов")
+    parser.add_argument("command", choices=["serve", "loadgen", "selftest"],
+                        help="serve - запустить сервис, loadgen - нагрузить работающий сервис, "
+                             "selftest - запустить сервис и нагрузку в одном процессе")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS, help="Окно сбора пакета")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE, help="Предел очереди запросов")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        service = ScoringService(args.max_batch, args.max_wait_ms, args.queue_size)
+        try:
+            asyncio.run(service.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "loadgen":
+        print(json.dumps(asyncio.run(run_load(args.host, args.port, args.concurrency, args.requests)), indent=2))
+    else:
+        print(json.dumps(asyncio.run(_self_test(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Анализ чувствительности: какая одна находка или пороговое значение изменит диагноз
+
+Для пациента строятся все варианты "одного изменения" - добавление или
+исключение каждого симптома и анализа из формы ввода (SYMPTOMS и LAB_OPTIONS;
+"Лейкоцитоз" и "Повышение СРБ" повторяли бы переходы через пороги) и переход каждого показателя через
+порог (температура 38 и 37-38, лейкоциты 10, СРБ 5, АД 180/120) - и все они
+оцениваются одним векторизованным вызовом score_bitsets (или пакетной оценкой
+вероятностной модели). Изменения ранжируются: сначала меняющие основной
+диагноз, затем меняющие порядок дифференциала, затем по величине сдвига.
+
+    python sensitivity.py --symptoms "Кашель;Одышка" --temperature 38.4 --wbc 9.5
+    python sensitivity.py --benchmark
+"""
+import argparse
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from diagnosis import score_bitsets
+from knowledge_base import get_knowledge_base
+from vocabulary import FINDING_IDS, LAB_OPTIONS, SYMPTOMS, encode_patient
+
+DIFFERENTIAL_SIZE = 4
+THRESHOLD_STEP = 0.1
+TOGGLED_FINDINGS = {name: FINDING_IDS[name] for name in SYMPTOMS + LAB_OPTIONS if name in FINDING_IDS}
+
+
+@dataclass(frozen=True)
+class Change:
+    """
+    Одно изменение входных данных и его влияние на результат
+    """
+    description: str
+    kind: str               # "add", "remove" или "threshold"
+    main_diagnosis: str     # основной диагноз после изменения
+    flips_main: bool
+    reorders_differential: bool
+    main_delta: float       # сдвиг баллов (вероятности) текущего основного диагноза
+    max_delta: float        # наибольший по модулю сдвиг среди всех состояний
+    deltas: dict
+
+
+def _variants(bits, temperature, bp_systolic, bp_diastolic, wbc, crp, thresholds, include_present=True):
+    """
+    Варианты входных данных с одним изменением: (описания, виды, маски, показатели)
+    """
+    descriptions, kinds = [], []
+    bitsets = []
+    vitals = []
+    base_vitals = (temperature, bp_systolic, bp_diastolic, wbc, crp)
+
+    for name, bit in TOGGLED_FINDINGS.items():
+        present = bits >> bit & 1
+        if present and not include_present:
+            continue
+        descriptions.append(f"Исключить: {name}" if present else f"Добавить: {name}")
+        kinds.append("remove" if present else "add")
+        bitsets.append(bits ^ (1 << bit))
+        vitals.append(base_vitals)
+
+    def crossing(description, temperature=temperature, bp_systolic=bp_systolic, bp_diastolic=bp_diastolic,
+                 wbc=wbc, crp=crp):
+        descriptions.append(description)
+        kinds.append("threshold")
+        bitsets.append(bits)
+        vitals.append((temperature, bp_systolic, bp_diastolic, wbc, crp))
+
+    fever = thresholds["fever_temperature"]
+    subfebrile = thresholds["subfebrile_temperature"]
+    if temperature > fever:
+        crossing(f"Температура ≤ {fever:g}", temperature=fever)
+    else:
+        crossing(f"Температура > {fever:g}", temperature=fever + THRESHOLD_STEP)
+    if not subfebrile < temperature < fever:
+        crossing(f"Температура {subfebrile:g}-{fever:g}", temperature=(subfebrile + fever) / 2)
+    if wbc > thresholds["wbc"]:
+        crossing(f"Лейкоциты ≤ {thresholds['wbc']:g}", wbc=thresholds["wbc"])
+    else:
+        crossing(f"Лейкоциты > {thresholds['wbc']:g}", wbc=thresholds["wbc"] + THRESHOLD_STEP)
+    if crp > thresholds["crp"]:
+        crossing(f"СРБ ≤ {thresholds['crp']:g}", crp=thresholds["crp"])
+    else:
+        crossing(f"СРБ > {thresholds['crp']:g}", crp=thresholds["crp"] + THRESHOLD_STEP)
+    bp_limit = f"{thresholds['bp_systolic']:g}/{thresholds['bp_diastolic']:g}"
+    if bp_systolic > thresholds["bp_systolic"] and bp_diastolic > thresholds["bp_diastolic"]:
+        crossing(f"АД ≤ {bp_limit}", bp_systolic=thresholds["bp_systolic"], bp_diastolic=thresholds["bp_diastolic"])
+    else:
+        crossing(
+            f"АД > {bp_limit}",
+            bp_systolic=max(bp_systolic, thresholds["bp_systolic"] + 1),
+            bp_diastolic=max(bp_diastolic, thresholds["bp_diastolic"] + 1),
+        )
+    return descriptions, kinds, np.array(bitsets, dtype=np.uint64), np.array(vitals, dtype=np.float64)
+
+
+def analyze(symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, kb=None, engine=None,
+            include_present=True, differential_size=DIFFERENTIAL_SIZE):
+    """
+    Ранжированный список изменений (Change), влияющих на результат; исходный пациент и все
+    варианты оцениваются одним пакетным вызовом. engine - вероятностная модель вместо правил.
+    """
+    kb = kb if kb is not None else get_knowledge_base()
+    bits = encode_patient(symptoms, lab_data)
+    descriptions, kinds, bitsets, vitals = _variants(
+        bits, temperature, bp_systolic, bp_diastolic, wbc, crp, kb.thresholds, include_present
+    )
+    # Строка 0 - исходный пациент
+    bitsets = np.concatenate([np.array([bits], dtype=np.uint64), bitsets])
+    vitals = np.vstack([[temperature, bp_systolic, bp_diastolic, wbc, crp], vitals])
+    score = engine.score_bitsets if engine is not None else score_bitsets
+    result = score(bitsets, *vitals.T, kb=kb)
+
+    scores = result.scores.astype(np.float64)
+    deltas = scores[1:] - scores[0]
+    ranking = result.ranking[:, :differential_size]
+    main = ranking[0, 0]
+    flips = ranking[1:, 0] != main
+    reorders = (ranking[1:] != ranking[0]).any(axis=1)
+    main_delta = deltas[:, main]
+    max_delta = np.abs(deltas).max(axis=1)
+
+    changed = np.flatnonzero(flips | reorders | (max_delta > 0))
+    # Сортировка: смена диагноза, смена порядка дифференциала, сдвиг основного диагноза, наибольший сдвиг
+    order = np.lexsort((-max_delta[changed], -np.abs(main_delta[changed]), ~reorders[changed], ~flips[changed]))
+    conditions = result.conditions
+    changes = []
+    for i in changed[order]:
+        nonzero = np.flatnonzero(deltas[i])
+        changes.append(Change(
+            description=descriptions[i],
+            kind=kinds[i],
+            main_diagnosis=conditions[ranking[i + 1, 0]],
+            flips_main=bool(flips[i]),
+            reorders_differential=bool(reorders[i]),
+            main_delta=deltas[i, main].item(),
+            max_delta=max_delta[i].item(),
+            deltas={conditions[col]: deltas[i, col].item() for col in nonzero},
+        ))
+    return changes
+
+
+def discriminating_tests(symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, kb=None,
+                         engine=None, top=5):
+    """
+    Недостающие находки и пороги показателей, которые сильнее всего меняют диагноз или дифференциал
+    """
+    changes = analyze(
+        symptoms, lab_data, temperature, bp_systolic, bp_diastolic, wbc, crp, kb, engine, include_present=False
+    )
+    return [change for change in changes if change.flips_main or change.reorders_differential][:top]
+
+
+def benchmark(runs=200, seed=0):
+    """
+    Время полного анализа для случайных пациентов, мс (p50, p99)
+    """
+    from benchmarks import synthetic_cohort
+
+    cohort = synthetic_cohort(runs, seed)
+    analyze(*cohort.patient(0))  # прогрев
+    samples = []
+    for i in range(runs):
+        started = time.perf_counter()
+        analyze(*cohort.patient(i))
+        samples.append((time.perf_counter() - started) * 1000)
+    p50, p99 = np.percentile(samples, [50, 99])
+    print(f"{runs} пациентов: p50 {p50:.2f} мс, p99 {p99:.2f} мс")
+    return p50, p99
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Какая одна находка или показатель изменит диагноз")
+    parser.add_argument("--symptoms", default="", help="Симптомы через ;")
+    parser.add_argument("--lab-data", default="", help="Результаты анализов через ;")
+    parser.add_argument("--temperature", type=float, default=37.0)
+    parser.add_argument("--bp-systolic", type=float, default=120)
+    parser.add_argument("--bp-diastolic", type=float, default=80)
+    parser.add_argument("--wbc", type=float, default=6.0)
+    parser.add_argument("--crp", type=float, default=2.0)
+    parser.add_argument("--all", action="store_true", help="Все изменения, а не только меняющие результат")
+    parser.add_argument("--benchmark", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        benchmark()
+        return
+    split = lambda value: [item.strip() for item in value.split(";") if item.strip()]
+    patient = (split(args.symptoms), split(args.lab_data), args.temperature, args.bp_systolic, args.bp_diastolic,
+               args.wbc, args.crp)
+    started = time.perf_counter()
+    changes = analyze(*patient) if args.all else discriminating_tests(*patient, top=None)
+    elapsed = (time.perf_counter() - started) * 1000
+    for change in changes:
+        effect = f"-> {change.main_diagnosis}" if change.flips_main else "порядок дифференциала"
+        print(f"{change.description:<40} {effect:<40} сдвиг {change.main_delta:+g}")
+    print(f"{len(changes)} изменений за {elapsed:.2f} мс")
+
+
+if __name__ == "__main__":
+    main()
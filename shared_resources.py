@@ -0,0 +1,67 @@
+"""
+Ресурсы процесса, общие для всех сессий Streamlit
+
+app.py выполняется заново при каждой перерисовке каждой сессии, поэтому
+кэшируемые ресурсы объявлены здесь: модуль импортируется один раз на процесс,
+и декораторы st.cache_resource не пересоздаются при каждой перерисовке.
+Все ресурсы разделяются между сессиями только для чтения (база знаний и
+модель не изменяются после загрузки, кэш и журнал потокобезопасны); в
+st.session_state остаются только значения виджетов.
+"""
+import sqlite3
+import warnings
+
+import streamlit as st
+
+import audit_log
+import instrumentation
+from knowledge_base import get_knowledge_base
+from result_cache import ResultCache
+
+
+# Кэш результатов, общий для всех сессий процесса
+@st.cache_resource
+def get_result_cache():
+    return ResultCache()
+
+
+# Модель извлечения симптомов из жалоб загружается один раз на процесс и только при первом использовании;
+# ошибка загрузки (нет torch/transformers или файлов модели) тоже кэшируется, чтобы не повторять загрузку
+@st.cache_resource
+def get_complaint_extractor():
+    from complaint_extraction import get_extractor
+    from ml_support import MLDependencyError
+
+    try:
+        return get_extractor()
+    except (MLDependencyError, OSError) as e:
+        return e
+
+
+# Вероятностная модель (probabilistic_scoring.py), если она обучена для текущей базы знаний
+@st.cache_resource
+def get_probabilistic_model():
+    from probabilistic_scoring import load_model
+    return load_model(kb=get_knowledge_base())
+
+
+# Журнал обращений с фоновой записью (AUDIT_LOG=0 отключает); если файл журнала недоступен
+# для записи, диагностика работает без журнала
+@st.cache_resource
+def get_audit_log():
+    if not audit_log.ENABLED:
+        return None
+    try:
+        return audit_log.AuditLog()
+    except (sqlite3.Error, OSError) as e:
+        warnings.warn(f"Журнал обращений отключен: {audit_log.DEFAULT_PATH} недоступен ({e})")
+        return None
+
+
+# Сервер метрик (DIAGNOSIS_METRICS=1) запускается один раз на процесс
+@st.cache_resource
+def start_instrumentation():
+    instrumentation.register_collector("result_cache", get_result_cache().stats)
+    if get_audit_log() is not None:
+        instrumentation.register_collector("audit_log", get_audit_log().stats)
+    return instrumentation.start_metrics_server()
@@ -0,0 +1,157 @@
+"""
+Профилирование холодного старта
+
+Каждый замер выполняется в новом процессе интерпретатора, чтобы учитывать
+реальный импорт модулей, а не кэш уже загруженного процесса.
+
+    python startup_profile.py imports --module diagnosis    # самые медленные импорты
+    python startup_profile.py render                        # время до первой отрисовки app.py
+    python startup_profile.py server                        # время до готовности streamlit run
+    python startup_profile.py budget --budget-ms 300        # код выхода 1 при превышении бюджета
+
+Команду budget можно запускать в CI: она не проходит, если медиана холодного
+импорта модуля диагностики превышает бюджет.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(ROOT, "app.py")
+
+CORE_MODULE = "diagnosis"
+DEFAULT_BUDGET_MS = 300.0
+DEFAULT_RUNS = 5
+
+
+def _run_python(code, *flags):
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True
+    )
+
+
+def cold_import_ms(module=CORE_MODULE, runs=DEFAULT_RUNS):
+    """
+    Время импорта модуля в новом процессе, мс (по одному значению на запуск)
+    """
+    code = (
+        "import time; started = time.perf_counter(); "
+        f"import {module}; print((time.perf_counter() - started) * 1000)"
+    )
+    return [float(_run_python(code).stdout.strip().splitlines()[-1]) for _ in range(runs)]
+
+
+def import_profile(module=CORE_MODULE, top=15):
+    """
+    Самые медленные модули по данным -X importtime: [(накопительное время мс, собственное мс, модуль)]
+    """
+    stderr = _run_python(f"import {module}", "-X", "importtime").stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            own, cumulative = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # строка заголовка
+        rows.append((cumulative / 1000, own / 1000, parts[2].rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def time_to_first_render(app_path=APP_PATH, runs=3):
+    """
+    Время от запуска процесса до завершения первого прогона скрипта Streamlit (AppTest), мс
+    """
+    code = (
+        "import time; started = time.perf_counter(); "
+        "from streamlit.testing.v1 import AppTest; imported = time.perf_counter(); "
+        f"at = AppTest.from_file({app_path!r}).run(timeout=60); "
+        "assert not at.exception, at.exception; "
+        "print((imported - started) * 1000, (time.perf_counter() - started) * 1000)"
+    )
+    results = []
+    for _ in range(runs):
+        streamlit_ms, total_ms = map(float, _run_python(code).stdout.strip().splitlines()[-1].split())
+        results.append({"streamlit_import_ms": streamlit_ms, "first_render_ms": total_ms})
+    return results
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_ready_ms(app_path=APP_PATH, timeout=60.0):
+    """
+    Время от запуска "streamlit run" до ответа health-эндпоинта и отдачи страницы, мс
+    """
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", app_path, "--server.headless", "true",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as response:
+                    if response.status == 200:
+                        break
+            except OSError:
+                time.sleep(0.05)
+        else:
+            raise TimeoutError(f"streamlit не ответил за {timeout} с")
+        health_ms = (time.perf_counter() - started) * 1000
+        urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5).read()
+        return {"health_ms": health_ms, "page_ms": (time.perf_counter() - started) * 1000}
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def check_budget(module=CORE_MODULE, budget_ms=DEFAULT_BUDGET_MS, runs=DEFAULT_RUNS):
+    """
+    Проверяет, что медиана холодного импорта не превышает бюджет; возвращает (успех, медиана)
+    """
+    median = statistics.median(cold_import_ms(module, runs))
+    return median <= budget_ms, median
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Профилирование холодного старта")
+    parser.add_argument("command", choices=["imports", "render", "server", "budget"])
+    parser.add_argument("--module", default=CORE_MODULE)
+    parser.add_argument("--app", default=APP_PATH)
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("COLD_IMPORT_BUDGET_MS", DEFAULT_BUDGET_MS)))
+    args = parser.parse_args(argv)
+
+    if args.command == "imports":
+        print(f"{'всего, мс':>10} {'свое, мс':>9}  модуль")
+        for cumulative, own, name in import_profile(args.module, args.top):
+            print(f"{cumulative:>10.1f} {own:>9.1f}  {name}")
+    elif args.command == "render":
+        for run in time_to_first_render(args.app, args.runs):
+            print(f"импорт streamlit {run['streamlit_import_ms']:.0f} мс, первая отрисовка {run['first_render_ms']:.0f} мс")
+    elif args.command == "server":
+        ready = server_ready_ms(args.app)
+        print(f"health {ready['health_ms']:.0f} мс, страница {ready['page_ms']:.0f} мс")
+    else:
+        ok, median = check_budget(args.module, args.budget_ms, args.runs)
+        print(f"Холодный импорт {args.module}: медиана {median:.1f} мс, бюджет {args.budget_ms:.0f} мс")
+        if not ok:
+            print("Бюджет холодного старта превышен", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
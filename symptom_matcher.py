@@ -0,0 +1,435 @@
+"""
+Лексический поиск симптомов в клинических текстах для массовой загрузки записей
+
+Текст разбивается на слова, слова приводятся к упрощенной основе (нижний
+регистр, ё -> е, отбрасывание окончаний), и поток основ за один проход
+обрабатывается автоматом Ахо-Корасик, построенным по названиям находок из
+vocabulary.py, критериям базы знаний и синонимам. Находки после слов-отрицаний
+("нет кашля", "без температуры", "отрицает одышку") помечаются отрицательными и
+в результат не попадают; отрицание распространяется на перечисление через
+запятую и "и" ("нет тошноты, рвоты, диареи") и заканчивается на конце
+предложения, в начале нового фрагмента ("но", "а", "беспокоит"...) или на
+утверждении ("нет лихорадки, есть кашель"); глагол сразу после отрицания его не
+прерывает ("не беспокоит кашель"). Отрицание после находки ("кашля нет")
+относится только к ней. Из вложенных находок остается самая длинная фраза
+("кашель с мокротой" - только "Кашель с мокротой").
+
+Результат - битовые маски vocabulary.py, которые сразу передаются в
+diagnosis.score_bitsets.
+
+    python symptom_matcher.py notes.txt --output matches.csv          # одна запись на строку
+    python symptom_matcher.py notes.jsonl --text-field text --output matches.csv
+    python symptom_matcher.py --benchmark --megabytes 50
+    python symptom_matcher.py --check                                  # примеры отрицаний (NEGATION_EXAMPLES)
+"""
+import argparse
+import csv
+import json
+import re
+import sys
+import time
+
+import numpy as np
+
+from knowledge_base import get_knowledge_base
+from vocabulary import FINDING_IDS, decode
+
+# Синонимы и словоформы, которые упрощенная основа не сводит к названию находки
+DEFAULT_SYNONYMS = {
+    "Лихорадка >38°C": ["лихорадка", "жар", "высокая температура", "фебрильная температура", "фебрильная лихорадка"],
+    "Озноб": ["знобит"],
+    "Кашель": ["кашля", "покашливание"],
+    "Кашель с мокротой": ["влажный кашель", "продуктивный кашель", "кашель с отделением мокроты", "кашля с мокротой"],
+    "Одышка": ["нехватка воздуха", "затрудненное дыхание"],
+    "Боль в груди": ["боли в груди", "боль за грудиной", "болит в груди"],
+    "Боль в горле": ["болит горло", "боли в горле", "першение в горле"],
+    "Налеты на миндалинах": ["налет на миндалинах", "гнойные налеты"],
+    "Увеличение лимфоузлов": ["увеличение шейных лимфоузлов", "лимфаденопатия", "увеличены лимфоузлы"],
+    "Дизурия": ["рези при мочеиспускании", "жжение при мочеиспускании", "болезненное мочеиспускание"],
+    "Учащенное мочеиспускание": ["частое мочеиспускание", "поллакиурия"],
+    "Боль в надлобковой области": ["боли внизу живота", "боль над лобком"],
+    "Диарея": ["понос", "жидкий стул"],
+    "Боль в животе": ["боли в животе", "болит живот"],
+    "Головная боль": ["болит голова", "головные боли", "цефалгия"],
+    "Фоно/фотофобия": ["светобоязнь", "звукобоязнь", "фотофобия", "фонофобия"],
+    "Ринорея": ["насморк", "выделения из носа"],
+    "Заложенность носа": ["нос заложен"],
+    "Слезотечение": ["слезятся глаза"],
+    "Мышечные боли": ["ломота в теле", "миалгия", "боли в мышцах"],
+    "Слабость": ["недомогание", "вялость", "общая слабость"],
+    "Внезапное начало": ["остро заболел", "острое начало"],
+    "Субфебрильная температура": ["субфебрилитет", "субфебрильная лихорадка"],
+    "Нарушение зрения": ["пелена перед глазами", "мелькание мушек"],
+    "Лейкоцитоз": ["лейкоцитоз в крови"],
+    "Повышение СРБ": ["срб повышен", "повышенный срб", "с-реактивный белок повышен"],
+}
+
+# Слова, открывающие область отрицания: она действует NEGATION_WINDOW слов после отрицания
+# или последней отрицаемой находки перечисления и заканчивается на границе предложения
+NEGATION_CUES = ("нет", "не", "без", "отрицает", "отрицают", "отсутствует", "отсутствуют", "отсутствие", "нету")
+NEGATION_WINDOW = 4
+# Отрицание сразу после находки: "кашля нет", "хрипы отсутствуют"; относится только к этой находке
+POST_NEGATION_CUES = ("нет", "нету", "отсутствует", "отсутствуют", "отрицает")
+# Слова, начинающие новый фрагмент: отрицание через них не переходит (кроме слова сразу после отрицания)
+CLAUSE_BREAKS = ("но", "а", "однако", "зато", "хотя", "кроме", "беспокоит", "беспокоят", "жалуется", "отмечает")
+# Утверждения заканчивают область отрицания так же, как начало нового фрагмента
+AFFIRMATION_CUES = ("есть", "имеется", "имеются", "отмечается", "отмечаются", "наблюдается", "присутствует")
+# Знаки конца предложения; запятая разделяет фразы, но не прерывает отрицание перечисления
+_SENTENCE_END = frozenset(".;:!?()\n")
+
+# Примеры для проверки отрицаний (--check): текст, найденные находки, находки под отрицанием
+NEGATION_EXAMPLES = (
+    ("Отрицает кашель, одышку, боль в груди.", (), ("Кашель", "Одышка", "Боль в груди")),
+    ("Нет тошноты, рвоты, диареи", (), ("Тошнота", "Рвота", "Диарея")),
+    ("Без озноба и слабости", (), ("Озноб", "Слабость")),
+    ("Кашля нет головная боль", ("Головная боль",), ("Кашель",)),
+    ("Кашель отсутствует одышка", ("Одышка",), ("Кашель",)),
+    ("Кашель, нет одышки", ("Кашель",), ("Одышка",)),
+    ("Нет одышки. Кашель", ("Кашель",), ("Одышка",)),
+    ("Нет одышки, но беспокоит кашель", ("Кашель",), ("Одышка",)),
+    ("Отрицает головную боль, а тошнота есть", ("Тошнота",), ("Головная боль",)),
+    ("Нет лихорадки, есть кашель", ("Кашель",), ("Лихорадка >38°C",)),
+    ("Кашель и нет одышки", ("Кашель",), ("Одышка",)),
+    ("Не беспокоит кашель", (), ("Кашель",)),
+    ("Не отмечает кашля", (), ("Кашель",)),
+    ("Не отмечается одышка, имеется слабость", ("Слабость",), ("Одышка",)),
+    ("Жалобы на кашель с мокротой", ("Кашель с мокротой",), ()),
+    ("Нет кашля с мокротой", (), ("Кашель с мокротой",)),
+    ("Кашель, позже кашель с мокротой", ("Кашель", "Кашель с мокротой"), ()),
+)
+
+_ENDINGS = tuple(sorted((
+    "иями", "ями", "ами", "ией", "ого", "его", "ому", "ему", "ыми", "ими", "ая", "яя", "ое", "ее", "ые", "ие",
+    "ой", "ей", "ий", "ый", "ом", "ем", "ам", "ям", "ах", "ях", "ов", "ев", "ию", "ью", "ия", "ья", "ую", "юю",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+), key=len, reverse=True))
+_MIN_STEM = 3
+
+# Слова (однобуквенные предлоги пропускаются, союзы "а" и "и" остаются) и границы фрагментов
+_TOKEN = re.compile(r"[а-яёa-z0-9]{2,}|(?<![а-яёa-z0-9])[аи](?![а-яёa-z0-9])|[.,;:!?()\n]")
+
+
+def stem(word):
+    """
+    Упрощенная основа слова: нижний регистр, ё -> е, без самого длинного подходящего окончания
+    """
+    word = word.lower().replace("ё", "е")
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def phrase_stems(phrase):
+    """
+    Основы слов фразы без чисел и однобуквенных слов (">38°C" в названии находки не является словом текста)
+    """
+    return tuple(stem(word) for word in _TOKEN.findall(phrase.lower()) if word.isalpha() and len(word) > 1)
+
+
+def default_lexicon(synonyms=None, kb=None):
+    """
+    {фраза: название находки}: названия из реестра, критерии базы знаний, которые совпадают
+    с находками или их синонимами, и синонимы
+    """
+    synonyms = DEFAULT_SYNONYMS if synonyms is None else synonyms
+    kb = kb if kb is not None else get_knowledge_base()
+    lexicon = {name: name for name in FINDING_IDS}
+    aliases = {phrase.lower(): name for name, phrases in synonyms.items() for phrase in phrases}
+    for info in kb.conditions.values():
+        for criterion in info.get("diagnosis_criteria", ()):
+            if criterion in FINDING_IDS:
+                lexicon[criterion] = criterion
+            elif criterion.lower() in aliases:
+                lexicon[criterion] = aliases[criterion.lower()]
+    for name, phrases in synonyms.items():
+        for phrase in phrases:
+            lexicon[phrase] = name
+    return lexicon
+
+
+class SymptomMatcher:
+    """
+    Автомат Ахо-Корасик над основами слов; один проход по тексту находит все фразы словаря
+    """
+
+    def __init__(self, lexicon=None, negation_cues=NEGATION_CUES, negation_window=NEGATION_WINDOW,
+                 post_negation_cues=POST_NEGATION_CUES, clause_breaks=CLAUSE_BREAKS,
+                 affirmation_cues=AFFIRMATION_CUES, stem_cache_size=500_000):
+        lexicon = default_lexicon() if lexicon is None else lexicon
+        self.negation_window = negation_window
+        self.stem_cache_size = stem_cache_size
+        self._stem_cache = {}
+        self._negation = {stem(cue) for cue in negation_cues}
+        self._post_negation = {stem(cue) for cue in post_negation_cues}
+        self._clause_breaks = {stem(word) for word in (*clause_breaks, *affirmation_cues)}
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [0]
+        self._output_length = [0]
+
+        for phrase, name in lexicon.items():
+            stems = phrase_stems(phrase)
+            if stems:
+                self._add(stems, 1 << FINDING_IDS[name])
+        self._alphabet = {token for edges in self._goto for token in edges}
+        self._build_failure_links()
+
+    def _add(self, stems, bit):
+        state = 0
+        for token in stems:
+            nxt = self._goto[state].get(token)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][token] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(0)
+                self._output_length.append(0)
+            state = nxt
+        self._output[state] |= bit
+        self._output_length[state] = len(stems)
+
+    def _build_failure_links(self):
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for token, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(token, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                # Состояние выдает только самую длинную фразу: более короткие по ссылкам неудач вложены в нее
+                if not self._output[nxt]:
+                    self._output[nxt] = self._output[self._fail[nxt]]
+                    self._output_length[nxt] = self._output_length[self._fail[nxt]]
+
+    def _classify(self, word):
+        # Основа слова, если она встречается в словаре; для отрицаний "!" (перед находкой), "!!" (после нее)
+        # или "!?" (и то и другое); "|" для начала нового фрагмента; None для прочих
+        token = stem(word)
+        pre, post = token in self._negation, token in self._post_negation
+        if pre or post:
+            token = "!?" if pre and post else "!!" if post else "!"
+        elif token in self._clause_breaks:
+            token = "|"
+        elif token not in self._alphabet:
+            token = None
+        if len(self._stem_cache) < self.stem_cache_size:
+            self._stem_cache[word] = token
+        return token
+
+    def match(self, text):
+        """
+        Возвращает (маска найденных находок, маска находок под отрицанием)
+        """
+        goto, fail, output, output_length = self._goto, self._fail, self._output, self._output_length
+        cache, classify, window = self._stem_cache, self._classify, self.negation_window
+        # Найденные фразы: [начало, маска, под отрицанием]; вложенная фраза заменяется объемлющей
+        spans = []
+        state = 0
+        position = 0
+        negation_until = -1
+        last_bits = last_position = cue_position = 0
+
+        for word in _TOKEN.findall(text.lower()):
+            if len(word) == 1 and not word.isalnum():
+                # Незавершенные фразы не переходят через знак; отрицание - только через запятую перечисления
+                state = 0
+                last_bits = cue_position = 0
+                if word in _SENTENCE_END:
+                    negation_until = -1
+                continue
+            position += 1
+            token = cache[word] if word in cache else classify(word)
+            if token is None:
+                state = 0
+                continue
+            if token == "|":
+                state = 0
+                last_bits = 0
+                # "не беспокоит кашель": глагол сразу после отрицания не начинает новый фрагмент
+                if cue_position != position - 1:
+                    negation_until = -1
+                continue
+            if token[0] == "!":
+                if token != "!" and last_bits and last_position == position - 1:
+                    # "кашля нет": отрицается только предшествующая находка
+                    spans[-1][2] = True
+                elif token != "!!":
+                    negation_until = position + window
+                    cue_position = position
+                state = 0
+                last_bits = 0
+                continue
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            bits = output[state]
+            if bits:
+                start = position - output_length[state]
+                while spans and spans[-1][0] >= start:
+                    spans.pop()
+                # Отрицание действует, если оно стоит перед началом найденной фразы
+                is_negated = start < negation_until
+                if is_negated:
+                    # Перечисление продолжает область отрицания: "нет тошноты, рвоты, диареи"
+                    negation_until = position + window
+                spans.append([start, bits, is_negated])
+                last_bits, last_position = bits, position
+
+        found = negated = 0
+        for _, bits, is_negated in spans:
+            if is_negated:
+                negated |= bits
+            else:
+                found |= bits
+        return found & ~negated, negated
+
+    def match_many(self, texts):
+        """
+        Маски найденных находок (uint64) для последовательности текстов
+        """
+        return np.array([self.match(text)[0] for text in texts], dtype=np.uint64)
+
+
+def load_synonyms(path):
+    with open(path, encoding="utf-8") as f:
+        extra = json.load(f)
+    merged = {name: list(phrases) for name, phrases in DEFAULT_SYNONYMS.items()}
+    for name, phrases in extra.items():
+        if name not in FINDING_IDS:
+            raise ValueError(f"{path}: неизвестная находка {name!r}")
+        merged.setdefault(name, []).extend(phrases)
+    return merged
+
+
+def iter_notes(path, text_field=None, id_field=None, encoding="utf-8"):
+    """
+    Потоково читает записи: .jsonl (поле text_field), .csv (столбец text_field) или текст по строке на запись.
+    Возвращает пары (идентификатор, текст) и число прочитанных байт.
+    """
+    with open(path, encoding=encoding, newline="") as f:
+        if path.endswith(".jsonl"):
+            for number, line in enumerate(f, 1):
+                if line.strip():
+                    record = json.loads(line)
+                    yield record.get(id_field, number) if id_field else number, record[text_field or "text"], len(line)
+        elif path.endswith(".csv"):
+            for number, row in enumerate(csv.DictReader(f), 1):
+                text = row[text_field or "text"]
+                yield row[id_field] if id_field else number, text, len(text)
+        else:
+            for number, line in enumerate(f, 1):
+                yield number, line.rstrip("\n"), len(line)
+
+
+def run(input_path, output_path=None, matcher=None, text_field=None, id_field=None, progress=True):
+    """
+    Обрабатывает файл записей и пишет CSV: id, найденные находки, маска, находки под отрицанием
+    """
+    matcher = matcher or SymptomMatcher()
+    out = open(output_path, "w", encoding="utf-8", newline="") if output_path else sys.stdout
+    writer = csv.writer(out)
+    writer.writerow(["id", "findings", "bitset", "negated"])
+    started = time.perf_counter()
+    notes = size = 0
+    try:
+        for note_id, text, length in iter_notes(input_path, text_field, id_field):
+            found, negated = matcher.match(text)
+            writer.writerow([note_id, ";".join(decode(found)), found, ";".join(decode(negated))])
+            notes += 1
+            size += length
+            if progress and notes % 100_000 == 0:
+                elapsed = time.perf_counter() - started
+                print(f"\r{notes:,} записей | {size / 1e6 / elapsed * 60:,.0f} МБ/мин", end="", file=sys.stderr)
+    finally:
+        if output_path:
+            out.close()
+    if progress:
+        elapsed = time.perf_counter() - started
+        print(f"\nГотово: {notes:,} записей, {size / 1e6:,.1f} МБ за {elapsed:.1f} с "
+              f"({size / 1e6 / max(elapsed, 1e-9) * 60:,.0f} МБ/мин)", file=sys.stderr)
+    return notes
+
+
+_FILLER = (
+    "пациент обратился с жалобами на", "в течение трех дней отмечает", "со слов пациента", "объективно",
+    "состояние удовлетворительное", "кожные покровы обычной окраски", "дыхание везикулярное", "хрипов нет",
+    "живот мягкий безболезненный", "рекомендовано наблюдение", "нет", "без",
+)
+
+
+def synthetic_corpus(megabytes, seed=0):
+    rng = np.random.default_rng(seed)
+    names = [name.lower() for name in FINDING_IDS]
+    lines, size = [], 0
+    while size < megabytes * 1e6:
+        parts = [str(rng.choice(_FILLER)) + " " + str(rng.choice(names)) for _ in range(int(rng.integers(3, 12)))]
+        line = ", ".join(parts) + "."
+        lines.append(line)
+        size += len(line.encode("utf-8")) + 1
+    return lines, size
+
+
+def benchmark(megabytes=20, seed=0):
+    """
+    Пропускная способность сопоставления на синтетических записях, МБ текста в минуту
+    """
+    matcher = SymptomMatcher()
+    lines, size = synthetic_corpus(megabytes, seed)
+    started = time.perf_counter()
+    for line in lines:
+        matcher.match(line)
+    elapsed = time.perf_counter() - started
+    rate = size / 1e6 / elapsed * 60
+    print(f"{len(lines):,} записей, {size / 1e6:.1f} МБ за {elapsed:.2f} с: {rate:,.0f} МБ/мин на одном ядре")
+    return rate
+
+
+def check_negation(matcher=None, examples=NEGATION_EXAMPLES):
+    """
+    Сверяет разбор отрицаний с примерами; возвращает список расхождений (текст, ожидалось, получено)
+    """
+    matcher = matcher or SymptomMatcher()
+    mismatches = []
+    for text, found, negated in examples:
+        got_found, got_negated = matcher.match(text)
+        expected = (sorted(found), sorted(negated))
+        got = (sorted(decode(got_found)), sorted(decode(got_negated)))
+        if got != expected:
+            mismatches.append((text, expected, got))
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Лексический поиск симптомов в клинических текстах")
+    parser.add_argument("input", nargs="?", help="Файл записей (.txt, .jsonl, .csv)")
+    parser.add_argument("--output", help="CSV с результатами (по умолчанию stdout)")
+    parser.add_argument("--text-field", help="Поле/столбец с текстом для .jsonl и .csv (по умолчанию text)")
+    parser.add_argument("--id-field", help="Поле/столбец с идентификатором записи")
+    parser.add_argument("--synonyms", help="JSON {находка: [синонимы]} в дополнение к встроенным")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--check", action="store_true", help="Проверить разбор отрицаний на NEGATION_EXAMPLES")
+    parser.add_argument("--megabytes", type=float, default=20)
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        benchmark(args.megabytes)
+        return
+    if args.check:
+        mismatches = check_negation()
+        for text, expected, got in mismatches:
+            print(f"{text!r}\n    ожидалось {expected}\n    получено  {got}")
+        print(f"{len(mismatches)} расхождений на {len(NEGATION_EXAMPLES)} примерах")
+        sys.exit(1 if mismatches else 0)
+    if not args.input:
+        parser.error("укажите файл записей или --benchmark")
+    lexicon = default_lexicon(load_synonyms(args.synonyms)) if args.synonyms else None
+    run(args.input, args.output, SymptomMatcher(lexicon), args.text_field, args.id_field, progress=not args.quiet)
+
+
+if __name__ == "__main__":
+    main()
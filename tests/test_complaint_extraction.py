@@ -0,0 +1,54 @@
+"""
+Извлечение симптомов из жалоб на детерминированной заглушке StubEncoder (без torch и сети)
+"""
+import pytest
+
+from complaint_extraction import STUB_THRESHOLD, ComplaintExtractor, StubEncoder, affirmed_clauses
+
+
+@pytest.fixture(scope="module")
+def extractor():
+    return ComplaintExtractor(StubEncoder(), threshold=STUB_THRESHOLD)
+
+
+@pytest.mark.parametrize("note, expected", [
+    ("Кашель, одышка", ["Кашель", "Одышка"]),
+    ("Кашель с мокротой, боль в груди", ["Кашель с мокротой", "Боль в груди"]),
+    ("Жалобы на пульсирующую головную боль и тошноту", ["Тошнота", "Пульсирующая головная боль"]),
+])
+def test_affirmed_findings(extractor, note, expected):
+    assert sorted(extractor.extract(note)) == sorted(expected)
+
+
+@pytest.mark.parametrize("note, expected", [
+    ("Отрицает головную боль", []),
+    ("Нет тошноты, рвоты, диареи", []),
+    ("Нет лихорадки, есть кашель", ["Кашель"]),
+    ("Не беспокоит кашель", []),
+    ("Не отмечает кашля", []),
+    ("Кашель и нет одышки", ["Кашель"]),
+    ("Кашля нет, головная боль", ["Головная боль"]),
+    ("Нет одышки, но беспокоит кашель", ["Кашель"]),
+    ("Отрицает кашель. Слабость", ["Слабость"]),
+])
+def test_negated_findings_are_dropped(extractor, note, expected):
+    assert sorted(extractor.extract(note)) == sorted(expected)
+
+
+def test_measurements_are_left_to_vitals(extractor):
+    # Температура вводится отдельным полем: "температура 39" не должна стать "Субфебрильной температурой"
+    assert sorted(extractor.extract("кашель, температура 39, одышка")) == ["Кашель", "Одышка"]
+
+
+def test_one_finding_per_clause(extractor):
+    assert extractor.extract("кашель") == ["Кашель"]
+
+
+def test_batch_matches_single_notes(extractor):
+    notes = ["Кашель, одышка", "", None, "Нет тошноты. Диарея"]
+    assert extractor.extract_batch(notes) == [extractor.extract(note) for note in notes]
+
+
+def test_affirmed_clauses_keep_clause_text():
+    assert affirmed_clauses("нет лихорадки, есть кашель") == ["есть кашель"]
+    assert affirmed_clauses("Кашля нет, головная боль") == ["головная боль"]
@@ -0,0 +1,209 @@
+"""
+Пакетная сортировка обращений из CSV/Parquet без интерфейса Streamlit
+
+Симптомы и анализы - строки через --delimiter или (в Parquet) столбцы-списки строк.
+
+Пример:
+    python triage_cli.py encounters.csv triaged.csv --chunksize 50000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from diagnosis import DEFAULT_VITALS, score_bitsets
+from knowledge_base import get_knowledge_base
+from vocabulary import encode_patients
+
+DIFFERENTIAL_SIZE = 3
+
+
+def _file_format(path, explicit=None):
+    if explicit:
+        return explicit
+    return "parquet" if path.lower().endswith((".parquet", ".pq")) else "csv"
+
+
+def iter_chunks(path, chunksize, fmt=None, sep=",", text_columns=()):
+    """
+    Читает файл частями, не загружая его целиком в память; text_columns из CSV читаются
+    как строки (с пропусками), чтобы тип столбца не зависел от содержимого части
+    """
+    if _file_format(path, fmt) == "parquet":
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        dtype = {"symptoms": str, "lab_data": str, **{column: "string" for column in text_columns}}
+        yield from pd.read_csv(path, chunksize=chunksize, sep=sep, dtype=dtype)
+
+
+def _findings(value, delimiter, column):
+    """
+    Находки одной ячейки: строка с разделителем, список (столбец-список Parquet) или пропуск
+    """
+    if isinstance(value, str):
+        items = value.split(delimiter)
+    elif isinstance(value, (list, tuple, np.ndarray)):
+        items = list(value)
+        if not all(isinstance(item, str) for item in items):
+            raise ValueError(f"{column}: элементы списка находок должны быть строками: {items!r}")
+    elif pd.isna(value):
+        return []
+    else:
+        raise ValueError(f"{column}: неподдерживаемое значение ячейки находок: {value!r}")
+    return [item.strip() for item in items if item.strip()]
+
+
+def _split_findings(chunk, column, delimiter):
+    if column not in chunk:
+        return [[]] * len(chunk)
+    return [_findings(value, delimiter, column) for value in chunk[column]]
+
+
+def parse_chunk(chunk, delimiter=";"):
+    """
+    Маски находок и показатели ({название: массив}) одной части обращений
+    """
+    symptoms = _split_findings(chunk, "symptoms", delimiter)
+    lab_data = _split_findings(chunk, "lab_data", delimiter)
+    vitals = {
+        name: pd.to_numeric(chunk[name], errors="coerce").fillna(default).to_numpy()
+        if name in chunk else np.full(len(chunk), default)
+        for name, default in DEFAULT_VITALS.items()
+    }
+    return encode_patients(symptoms, lab_data), vitals
+
+
+def score_chunk(chunk, delimiter=";", keep_columns=(), kb=None, model=None):
+    """
+    Оценивает одну часть обращений и возвращает таблицу с диагнозом, баллами и дифференциалом;
+    с вероятностной моделью (model) вместо баллов выводятся вероятности
+    """
+    bitsets, vitals = parse_chunk(chunk, delimiter)
+    score = model.score_bitsets if model is not None else score_bitsets
+    result = score(
+        bitsets, vitals["temperature"], vitals["bp_systolic"], vitals["bp_diastolic"], vitals["wbc"], vitals["crp"],
+        kb,
+    )
+    value = "probability" if model is not None else "score"
+
+    names = np.array(result.conditions, dtype=object)
+    ranked_scores = np.take_along_axis(result.scores, result.ranking, axis=1)
+
+    out = pd.DataFrame(index=chunk.index)
+    for column in keep_columns:
+        out[column] = chunk[column]
+    out["main_diagnosis"] = names[result.ranking[:, 0]]
+    out[f"main_{value}"] = ranked_scores[:, 0]
+    for place in range(1, DIFFERENTIAL_SIZE + 1):
+        out[f"differential_{place}"] = names[result.ranking[:, place]]
+        out[f"differential_{place}_{value}"] = ranked_scores[:, place]
+    for column, condition in enumerate(result.conditions):
+        out[f"{value}_{condition}"] = result.scores[:, column]
+    return out
+
+
+class _OutputWriter:
+    """
+    Дописывает результаты по частям в CSV или Parquet
+    """
+
+    def __init__(self, path, fmt=None):
+        self.path = path
+        self.format = _file_format(path, fmt)
+        self._parquet_writer = None
+        self._started = False
+
+    def write(self, frame):
+        if self.format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            else:
+                # Тип столбца, выведенный по части (например, int64 -> double из-за пропуска), приводится к схеме файла
+                table = table.cast(self._parquet_writer.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode="a" if self._started else "w", header=not self._started, index=False)
+        self._started = True
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+
+def run(input_path, output_path, chunksize=50_000, delimiter=";", keep_columns=(),
+        input_format=None, output_format=None, sep=",", progress=True, model=None):
+    """
+    Потоковая обработка файла обращений; возвращает число обработанных строк
+    """
+    # Одна версия базы знаний на весь файл, даже если она обновится во время обработки
+    kb = get_knowledge_base()
+    writer = _OutputWriter(output_path, output_format)
+    total_bytes = os.path.getsize(input_path)
+    rows = 0
+    started = time.perf_counter()
+    try:
+        for chunk in iter_chunks(input_path, chunksize, input_format, sep, text_columns=keep_columns):
+            writer.write(score_chunk(chunk, delimiter, keep_columns, kb, model))
+            rows += len(chunk)
+            if progress:
+                elapsed = time.perf_counter() - started
+                print(
+                    f"\r{rows:,} строк | {rows / elapsed:,.0f} строк/с | {elapsed:.1f} с",
+                    end="", file=sys.stderr, flush=True,
+                )
+    finally:
+        writer.close()
+
+    if progress:
+        elapsed = time.perf_counter() - started
+        print(
+            f"\nГотово: {rows:,} строк из {total_bytes / 1e6:,.1f} МБ за {elapsed:.1f} с "
+            f"({rows / max(elapsed, 1e-9):,.0f} строк/с)",
+            file=sys.stderr,
+        )
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная диагностика обращений из CSV/Parquet")
+    parser.add_argument("input", help="Входной файл (.csv или .parquet)")
+    parser.add_argument("output", help="Выходной файл (.csv или .parquet)")
+    parser.add_argument("--chunksize", type=int, default=50_000, help="Строк в одной части (ограничивает память)")
+    parser.add_argument("--delimiter", default=";", help="Разделитель симптомов и анализов внутри ячейки")
+    parser.add_argument("--sep", default=",", help="Разделитель столбцов CSV")
+    parser.add_argument("--keep", nargs="*", default=[], help="Столбцы, копируемые в результат (например, encounter_id)")
+    parser.add_argument("--input-format", choices=["csv", "parquet"])
+    parser.add_argument("--output-format", choices=["csv", "parquet"])
+    parser.add_argument("--quiet", action="store_true", help="Не выводить прогресс")
+    parser.add_argument("--engine", choices=["rules", "bayes"], default="rules",
+                        help="Баллы по правилам или вероятности обученной модели")
+    parser.add_argument("--model", help="Файл модели для --engine bayes (по умолчанию DIAGNOSIS_MODEL)")
+    args = parser.parse_args(argv)
+
+    model = None
+    if args.engine == "bayes":
+        from probabilistic_scoring import DEFAULT_MODEL_PATH, ProbabilisticModel
+
+        model = ProbabilisticModel.load(args.model or DEFAULT_MODEL_PATH)
+
+    run(
+        args.input, args.output,
+        chunksize=args.chunksize, delimiter=args.delimiter, keep_columns=args.keep,
+        input_format=args.input_format, output_format=args.output_format,
+        sep=args.sep, progress=not args.quiet, model=model,
+    )
+
+
+if __name__ == "__main__":
+    main()
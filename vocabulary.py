@@ -0,0 +1,168 @@
+# РЕЕСТР СИМПТОМОВ И НАХОДОК
+# Единый источник названий для интерфейса, правил и API. Каждой находке присвоен
+# постоянный номер бита: номера не меняются и не переиспользуются, новые находки
+# добавляются в свободные номера своего диапазона.
+import numpy as np
+
+# Симптомы: биты 0-47 (порядок совпадает со списком в интерфейсе)
+SYMPTOM_IDS = {
+    "Лихорадка >38°C": 0,
+    "Озноб": 1,
+    "Кашель": 2,
+    "Кашель с мокротой": 3,
+    "Одышка": 4,
+    "Боль в груди": 5,
+    "Боль в горле": 6,
+    "Налеты на миндалинах": 7,
+    "Увеличение лимфоузлов": 8,
+    "Дизурия": 9,
+    "Учащенное мочеиспускание": 10,
+    "Боль в надлобковой области": 11,
+    "Тошнота": 12,
+    "Рвота": 13,
+    "Диарея": 14,
+    "Боль в животе": 15,
+    "Головная боль": 16,
+    "Пульсирующая головная боль": 17,
+    "Односторонняя локализация": 18,
+    "Тошнота/рвота": 19,
+    "Фоно/фотофобия": 20,
+    "Аура": 21,
+    "Чихание": 22,
+    "Ринорея": 23,
+    "Заложенность носа": 24,
+    "Зуд в носу": 25,
+    "Слезотечение": 26,
+    "Мышечные боли": 27,
+    "Слабость": 28,
+    "Внезапное начало": 29,
+    "Сезонность": 30,
+    "Субфебрильная температура": 31,
+    "Нарушение зрения": 32,
+}
+
+# Лабораторные находки: биты 48-55
+LAB_IDS = {
+    "Лейкоцитоз": 48,
+    "Повышение СРБ": 49,
+    "Лейкоциты в моче": 50,
+    "Нитриты в моче": 51,
+    "Анализы в норме": 52,
+}
+
+# Биты 56-63: производные признаки, которые диагностика вычисляет из находок
+# и числовых показателей (лихорадка с учетом температуры, лейкоцитоз и т.д.)
+DERIVED_BITS_START = 56
+BITSET_WIDTH = 64
+
+DERIVED_FEATURES = ("fever", "subfebrile", "leukocytosis", "elevated_crp", "urinary_leukocytes", "cough_without_sputum")
+DERIVED_BITS = {name: DERIVED_BITS_START + i for i, name in enumerate(DERIVED_FEATURES)}
+
+FINDING_IDS = {**SYMPTOM_IDS, **LAB_IDS}
+FINDING_NAMES = {bit: name for name, bit in FINDING_IDS.items()}
+
+# Все признаки, на которые могут ссылаться правила базы знаний
+FEATURE_BITS = {**FINDING_IDS, **DERIVED_BITS}
+
+SYMPTOMS = tuple(SYMPTOM_IDS)
+LAB_FINDINGS = tuple(LAB_IDS)
+
+# Варианты в форме ввода: лейкоцитоз и СРБ задаются числами, а не флажками
+LAB_OPTIONS = ("Лейкоциты в моче", "Нитриты в моче", "Анализы в норме")
+
+assert len(set(FINDING_IDS.values())) == len(FINDING_IDS)
+assert max(FINDING_IDS.values()) < DERIVED_BITS_START
+assert max(DERIVED_BITS.values()) < BITSET_WIDTH
+
+
+def encode(findings, ids=FINDING_IDS):
+    """
+    Кодирует набор названий в битовую маску (int); неизвестные названия (не из ids) игнорируются
+    """
+    bits = 0
+    for name in findings:
+        bit = ids.get(name)
+        if bit is not None:
+            bits |= 1 << bit
+    return bits
+
+
+def encode_patient(symptoms, lab_data):
+    """
+    Маска пациента: симптомы читаются только из symptoms, лабораторные находки - только из lab_data,
+    как в эталонной medical_diagnosis_system (название не из своего списка игнорируется)
+    """
+    return encode(symptoms, SYMPTOM_IDS) | encode(lab_data, LAB_IDS)
+
+
+def decode(bits):
+    """
+    Возвращает названия находок из битовой маски в порядке номеров битов
+    """
+    bits = int(bits)
+    return [name for bit, name in sorted(FINDING_NAMES.items()) if bits >> bit & 1]
+
+
+def encode_many(*finding_lists):
+    """
+    Кодирует N пациентов в массив uint64; каждый аргумент - последовательность из N списков
+    (например, симптомы и анализы), их биты объединяются
+    """
+    ids = FINDING_IDS
+    encoded = []
+    for findings in zip(*finding_lists):
+        bits = 0
+        for group in findings:
+            for name in group:
+                bit = ids.get(name)
+                if bit is not None:
+                    bits |= 1 << bit
+        encoded.append(bits)
+    return np.array(encoded, dtype=np.uint64)
+
+
+def encode_patients(symptoms, lab_data):
+    """
+    encode_patient для N пациентов: массив uint64
+    """
+    symptom_ids, lab_ids = SYMPTOM_IDS, LAB_IDS
+    encoded = []
+    for patient_symptoms, patient_lab_data in zip(symptoms, lab_data):
+        bits = 0
+        for name in patient_symptoms:
+            bit = symptom_ids.get(name)
+            if bit is not None:
+                bits |= 1 << bit
+        for name in patient_lab_data:
+            bit = lab_ids.get(name)
+            if bit is not None:
+                bits |= 1 << bit
+        encoded.append(bits)
+    return np.array(encoded, dtype=np.uint64)
+
+
+def decode_many(bitsets):
+    return [decode(bits) for bits in bitsets]
+
+
+def mask(names):
+    """
+    Маска uint64 для набора названий или номеров битов
+    """
+    bits = 0
+    for name in names:
+        bits |= 1 << (name if isinstance(name, int) else FINDING_IDS[name])
+    return np.uint64(bits)
+
+
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    """
+    Число установленных битов в каждом элементе массива uint64
+    """
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _BYTE_POPCOUNT[values[..., None].view(np.uint8)].sum(axis=-1, dtype=np.uint8)